@@ -0,0 +1,134 @@
+import asyncio, atexit, os
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+
+import synthesis_server as server
+
+# Asyncio serving mode, the same routes as synthesis_server.py on an aiohttp event loop. Run with
+#  python async_server.py
+# The event loop only parses requests and writes responses. Ingest (segmenting and queueing text) runs on
+# a small thread pool so a request waiting on a session's buffer lock never stalls the loop, and model
+# loading gets its own thread so a slow load doesn't hold up ingest. Synthesis itself stays on the
+# synthesis workers, so ingest latency doesn't depend on how busy they are
+
+ingest_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("INGEST_THREADS", "4")), thread_name_prefix="ingest")
+model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="load-model")
+
+# Run one of the server's handle_ functions off the event loop and turn its result into a JSON response
+async def run_handler(handler, request, executor):
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Request body must be JSON."}, status=400)
+    body, status, headers = await asyncio.get_running_loop().run_in_executor(executor, handler, data or {})
+    return web.json_response(body, status=status, headers=headers)
+
+async def load_model(request):
+    return await run_handler(server.handle_load_model, request, model_executor)
+
+async def synthesis(request):
+    return await run_handler(server.handle_synthesis, request, ingest_executor)
+
+# Newline delimited JSON fragments streamed on one request, each line handled as it arrives
+async def synthesis_stream(request):
+    loop = asyncio.get_running_loop()
+    results = []
+    async for line in request.content:
+        if line.strip():
+            results.append(await loop.run_in_executor(ingest_executor, server.handle_ingest_line, line))
+    accepted = sum(result["code"] == 200 for result in results)
+    return web.json_response({"status": "success" if accepted == len(results) else "error", "accepted": accepted, "results": results})
+
+# Persistent ingest channel. Every text message is a fragment or a batch as /synthesis takes them and is
+# answered with what /synthesis would have returned, its status code in "code"
+async def ingest(request):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    loop = asyncio.get_running_loop()
+    async for message in ws:
+        if message.type == web.WSMsgType.TEXT:
+            await ws.send_json(await loop.run_in_executor(ingest_executor, server.handle_ingest_line, message.data))
+        elif message.type == web.WSMsgType.ERROR:
+            break
+    return ws
+
+async def set_voice(request):
+    return await run_handler(server.handle_set_voice, request, ingest_executor)
+
+async def end_session(request):
+    return await run_handler(server.handle_end_session, request, ingest_executor)
+
+# Streams a session's Ogg Opus pages, each blocking read of the sink happens on the default executor
+async def stream_audio(request):
+    session_id = request.match_info["session_id"]
+    session = server.find_session(session_id)
+    if session is None:
+        return web.json_response({"status": "error", "message": f"Unknown session {session_id}."}, status=404)
+    if not isinstance(session.audio_sink, server.OpusStreamSink):
+        return web.json_response({"status": "error", "message": "Audio streaming needs AUDIO_SINK=opus."}, status=404)
+    response = web.StreamResponse(headers={"Content-Type": "audio/ogg", "Access-Control-Allow-Origin": "*"})
+    await response.prepare(request)
+    pages = session.audio_sink.listen()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            page = await loop.run_in_executor(None, next, pages, None)
+            if page is None:
+                break
+            await response.write(page)
+    finally:
+        pages.close()
+    return response
+
+async def healthz(request):
+    body, status, headers = server.handle_healthz()
+    return web.json_response(body, status=status, headers=headers)
+
+async def readyz(request):
+    body, status, headers = server.handle_readyz()
+    return web.json_response(body, status=status, headers=headers)
+
+async def traces(request):
+    body, status, headers = server.handle_traces()
+    return web.json_response(body, status=status, headers=headers)
+
+async def metrics_endpoint(request):
+    return web.Response(body=server.metrics.prometheus().encode(), headers={"Content-Type": "text/plain; version=0.0.4"})
+
+async def testing_logs_endpoint(request):
+    return web.json_response(server.export_testing_logs())
+
+async def preflight(request):
+    return web.Response(headers={
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers": request.headers.get("Access-Control-Request-Headers", "*")
+    })
+
+# Allow cross origin requests like flask_cors does for the Flask app
+@web.middleware
+async def cors_middleware(request, handler):
+    response = await handler(request)
+    if not response.prepared:
+        response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware])
+    app.router.add_post("/load_model", load_model)
+    app.router.add_post("/synthesis", synthesis)
+    app.router.add_post("/synthesis_stream", synthesis_stream)
+    app.router.add_get("/ingest", ingest)
+    app.router.add_post("/set_voice", set_voice)
+    app.router.add_post("/end_session", end_session)
+    app.router.add_get("/audio/{session_id}", stream_audio)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/traces", traces)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_get("/testing_logs", testing_logs_endpoint)
+    app.router.add_route("OPTIONS", "/{path:.*}", preflight)
+    return app
+
+if __name__ == "__main__":
+    atexit.register(server.save_testing_logs)
+    web.run_app(create_app(), host="127.0.0.1", port=5000)
@@ -0,0 +1,101 @@
+import os, hashlib
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+
+# Normalize text so differently spaced or capitalised transcripts of the same sentence share an entry
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+# LRU cache of finished int16 waveforms with a byte budget in memory. Entries evicted from memory
+# spill to .npy files in cache_dir, which are memory mapped when hit so the cache survives restarts
+class AudioCache:
+    def __init__(self, max_bytes, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # key -> wav, least recently used first
+        self.bytes = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(model, voice, speed, text):
+        raw = f"{model}|{voice}|{speed:.2f}|{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy") if self.cache_dir else None
+
+    # Return the cached waveform for key or None, checking memory before the on-disk store
+    def get(self, key):
+        with self.lock:
+            wav = self.entries.get(key)
+            if wav is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return wav
+
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                wav = np.load(path, mmap_mode="r")
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return wav
+            except Exception as e:
+                print(f"Audio cache read error for {path}:", e)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, wav):
+        evicted = []
+        with self.lock:
+            if key in self.entries or wav.nbytes > self.max_bytes:
+                return
+            self.entries[key] = wav
+            self.bytes += wav.nbytes
+            while self.bytes > self.max_bytes:
+                evicted_key, evicted_wav = self.entries.popitem(last=False)
+                self.bytes -= evicted_wav.nbytes
+                evicted.append((evicted_key, evicted_wav))
+        for evicted_key, evicted_wav in evicted:
+            self._spill(evicted_key, evicted_wav)
+
+    # Write an entry to the on-disk store, via a temporary file so readers never see a partial write
+    def _spill(self, key, wav):
+        path = self._path(key)
+        if path is None or os.path.exists(path):
+            return
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.asarray(wav, dtype=np.int16))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Audio cache write error for {path}:", e)
+
+    # Spill everything still in memory, called at exit so the next run starts warm
+    def flush(self):
+        with self.lock:
+            entries = list(self.entries.items())
+        for key, wav in entries:
+            self._spill(key, wav)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk hits": self.disk_hits,
+                "misses": self.misses,
+                "hit rate": self.hits / lookups if lookups else 0,
+                "memory bytes": self.bytes,
+                "memory entries": len(self.entries)
+            }
@@ -0,0 +1,289 @@
+import time, wave, subprocess, queue
+import numpy as np
+from collections import deque
+from threading import Condition, Lock, Thread
+
+# Preallocated buffer of int16 samples shared between the playback worker and whatever consumes the audio.
+# Positions are absolute sample counts, the index into the buffer is the position modulo capacity
+class RingBuffer:
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.read_pos = 0
+        self.write_pos = 0
+        self.cond = Condition()
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    # Copy samples into the buffer, blocking while it is full
+    def write(self, samples):
+        offset = 0
+        while offset < len(samples):
+            with self.cond:
+                while self.write_pos - self.read_pos >= self.capacity:
+                    self.cond.wait()
+                count = min(len(samples) - offset, self.capacity - (self.write_pos - self.read_pos))
+                start = self.write_pos % self.capacity
+                first = min(count, self.capacity - start)
+                self.buffer[start:start + first] = samples[offset:offset + first]
+                self.buffer[:count - first] = samples[offset + first:offset + count]
+                self.write_pos += count
+                offset += count
+                self.cond.notify_all()
+
+    # Copy whatever is available into out and zero fill the rest, returns the number of samples copied.
+    # Never blocks so it is safe in an audio callback
+    def read_into(self, out):
+        with self.cond:
+            count = min(len(out), self.write_pos - self.read_pos)
+            start = self.read_pos % self.capacity
+            first = min(count, self.capacity - start)
+            out[:first] = self.buffer[start:start + first]
+            out[first:count] = self.buffer[:count - first]
+            out[count:] = 0
+            self.read_pos += count
+            self.cond.notify_all()
+            return count
+
+    # Block until there are samples to read or the timeout passes
+    def wait_for_data(self, timeout=None):
+        with self.cond:
+            if self.write_pos == self.read_pos:
+                self.cond.wait(timeout)
+            return self.write_pos > self.read_pos
+
+# Base for everywhere synthesized audio can go. The playback worker writes samples in order and places
+# markers, and the sink calls each marker with the time in ms once the samples before it have been consumed.
+# Subclasses consume audio by calling _consume from their own clock (an audio callback or a pacing thread)
+class AudioSink:
+    def __init__(self, sample_rate, buffer_seconds=2.0, frame_samples=480):
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+        self.ring = RingBuffer(int(sample_rate * buffer_seconds))
+        self.markers = deque()  # (sample position, callback) pairs in position order
+        self.markers_lock = Lock()  # markers are placed by the playback worker and fired by the consumer
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def _consume(self, out):
+        count = self.ring.read_into(out)
+        if self.markers:
+            self._fire_markers()
+        return count
+
+    # Call the markers whose samples have all been consumed, in order. Held under markers_lock so a marker
+    # fired by mark() can't overtake one the consumer is firing
+    def _fire_markers(self):
+        with self.markers_lock:
+            read_pos = self.ring.read_pos
+            now = time.time() * 1000
+            while self.markers and self.markers[0][0] <= read_pos:
+                _, callback = self.markers.popleft()
+                callback(now)
+
+    # Call callback with the time in ms once everything written so far has been consumed. Fires at once when
+    # the output has already drained, the consumer may not run again until more audio is written
+    def mark(self, callback):
+        with self.markers_lock:
+            self.markers.append((self.ring.write_pos, callback))
+        if self.ring.write_pos <= self.ring.read_pos:
+            self._fire_markers()
+
+    # Queue samples for output, blocks while the ring buffer is full
+    def write(self, wav):
+        if not self.started:
+            self.start()
+        self.ring.write(wav)
+
+    def buffered_seconds(self):
+        return self.ring.available() / self.sample_rate
+
+    def close(self):
+        self.started = False
+
+# Plays audio through a single sounddevice output stream that stays open for the life of the session
+class SoundDeviceSink(AudioSink):
+    def __init__(self, sample_rate, buffer_seconds=2.0, frame_samples=480):
+        super().__init__(sample_rate, buffer_seconds, frame_samples)
+        self.stream = None
+
+    def start(self):
+        # Imported here so servers without an audio device never load PortAudio
+        import sounddevice as sd
+        self.stream = sd.OutputStream(
+            samplerate=self.sample_rate,
+            channels=1,
+            dtype="int16",
+            blocksize=self.frame_samples,
+            callback=self._callback
+        )
+        self.stream.start()
+        self.started = True
+
+    def _callback(self, outdata, frames, time_info, status):
+        self._consume(outdata[:, 0])
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self.started = False
+
+# Sink driven by its own thread, taking one frame at a time. In realtime mode frames are taken at the pace
+# a listener would hear them, with silence when nothing is queued, so backlog and latency behave like a
+# sound card. Otherwise audio is taken as fast as it is written, for benchmarks. Subclasses implement emit
+class PacedSink(AudioSink):
+    def __init__(self, sample_rate, buffer_seconds=2.0, frame_samples=480, realtime=True):
+        super().__init__(sample_rate, buffer_seconds, frame_samples)
+        self.realtime = realtime
+        self.thread = None
+
+    def start(self):
+        self.started = True
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        frame = np.zeros(self.frame_samples, dtype=np.int16)
+        frame_seconds = self.frame_samples / self.sample_rate
+        next_frame_time = time.monotonic()
+        while self.started:
+            if self.realtime:
+                self._consume(frame)
+                self.emit(frame)
+                next_frame_time += frame_seconds
+                delay = next_frame_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame_time = time.monotonic()
+            elif self.ring.wait_for_data(timeout=0.1):
+                count = self._consume(frame)
+                self.emit(frame[:count])
+            elif self.markers:
+                self._fire_markers()
+
+    def emit(self, frame):
+        raise NotImplementedError
+
+    def close(self):
+        self.started = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+# Discards audio, for benchmarks and headless runs where only the latency measurements matter
+class NullSink(PacedSink):
+    def emit(self, frame):
+        pass
+
+# Writes what the listener would hear to a 16-bit mono WAV file
+class WavFileSink(PacedSink):
+    def __init__(self, sample_rate, path, buffer_seconds=2.0, frame_samples=480, realtime=True):
+        super().__init__(sample_rate, buffer_seconds, frame_samples, realtime)
+        self.path = path
+        self.wav_file = None
+
+    def start(self):
+        self.wav_file = wave.open(self.path, "wb")
+        self.wav_file.setnchannels(1)
+        self.wav_file.setsampwidth(2)
+        self.wav_file.setframerate(self.sample_rate)
+        super().start()
+
+    def emit(self, frame):
+        self.wav_file.writeframes(frame.tobytes())
+
+    def close(self):
+        super().close()
+        if self.wav_file is not None:
+            self.wav_file.close()
+            self.wav_file = None
+
+# Encodes audio to Ogg Opus in 20 ms frames with a resident ffmpeg/libopus process (the same s16le ->
+# libopus setup as tests/compare_opus_bandwidth.py) and fans the Ogg pages out to any number of listeners.
+# Listeners that join late get the stream's header pages first
+class OpusStreamSink(PacedSink):
+    def __init__(self, sample_rate, buffer_seconds=2.0, bitrate="24k", realtime=True):
+        super().__init__(sample_rate, buffer_seconds, frame_samples=sample_rate // 50, realtime=realtime)
+        self.bitrate = bitrate
+        self.encoder = None
+        self.header_pages = []  # OpusHead and OpusTags pages
+        self.listeners = []
+        self.listeners_lock = Lock()
+
+    def start(self):
+        self.encoder = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-f", "s16le",
+                "-ar", str(self.sample_rate),
+                "-ac", "1",
+                "-i", "pipe:0",
+                "-c:a", "libopus",
+                "-b:a", self.bitrate,
+                "-frame_duration", "20",
+                "-application", "voip",
+                "-page_duration", "20000",
+                "-flush_packets", "1",
+                "-f", "ogg",
+                "pipe:1"
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        Thread(target=self._read_pages, daemon=True).start()
+        super().start()
+
+    def emit(self, frame):
+        self.encoder.stdin.write(frame.tobytes())
+        self.encoder.stdin.flush()
+
+    # Split the encoder output into Ogg pages and hand each one to every listener
+    def _read_pages(self):
+        stdout = self.encoder.stdout
+        while True:
+            header = stdout.read(27)
+            if len(header) < 27 or header[:4] != b"OggS":
+                break
+            segment_table = stdout.read(header[26])
+            body = stdout.read(sum(segment_table))
+            page = header + segment_table + body
+            with self.listeners_lock:
+                if len(self.header_pages) < 2:
+                    self.header_pages.append(page)
+                for listener in self.listeners:
+                    listener.put(page)
+        with self.listeners_lock:
+            for listener in self.listeners:
+                listener.put(None)
+
+    # Generator of Ogg pages for one listener, ends when the sink closes or the listener goes away
+    def listen(self):
+        listener = queue.Queue()
+        with self.listeners_lock:
+            pages = list(self.header_pages)
+            self.listeners.append(listener)
+        try:
+            for page in pages:
+                yield page
+            while True:
+                page = listener.get()
+                if page is None:
+                    return
+                yield page
+        finally:
+            with self.listeners_lock:
+                self.listeners.remove(listener)
+
+    def close(self):
+        super().close()
+        if self.encoder is not None:
+            self.encoder.stdin.close()
+            self.encoder.wait(timeout=5)
+            self.encoder = None
@@ -0,0 +1,25 @@
+import re, time
+import numpy as np
+
+# Stand-in for Kokoro's KPipeline for load tests and benchmarks, loaded with {"model": "fake"}. Audio is a
+# quiet tone whose length follows the text at a fixed speaking rate, and each chunk takes a fixed fraction
+# of its audio length to "synthesize", so runs are repeatable on any machine without model weights.
+# Yields (graphemes, phonemes, audio) per clause like KPipeline
+
+clause_pattern = re.compile(r"[^,;:.!?]+[,;:.!?]*")
+
+class FakePipeline:
+    def __init__(self, chars_per_second=15.0, real_time_factor=0.05, sample_rate=24000, lang_code='a'):
+        self.chars_per_second = chars_per_second
+        self.real_time_factor = real_time_factor  # seconds of compute per second of audio
+        self.sample_rate = sample_rate
+
+    def __call__(self, text, voice='af_heart', speed=1):
+        for clause in clause_pattern.findall(text):
+            clause = clause.strip()
+            if not clause:
+                continue
+            samples = int(len(clause) / self.chars_per_second / speed * self.sample_rate)
+            time.sleep(samples / self.sample_rate * self.real_time_factor)
+            tone = 0.1 * np.sin(2 * np.pi * 220 * np.arange(samples) / self.sample_rate)
+            yield clause, "", tone.astype(np.float32)
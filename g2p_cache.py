@@ -0,0 +1,117 @@
+import copy
+from collections import OrderedDict
+from threading import Lock
+
+# Bounded least recently used map with hit counting
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "hit rate": self.hits / lookups if lookups else 0.0}
+
+# Phoneme cache in front of a Kokoro pipeline's G2P. Whole segments are cached by their exact text, and the
+# espeak fallback for words missing from the lexicon (the slow part of English G2P) is cached by word.
+# Cached tokens are copied on the way out because the pipeline writes timestamps onto them
+class CachedG2P:
+    def __init__(self, g2p, max_sentences=4096, max_words=16384):
+        self.g2p = g2p
+        self.sentences = LRUCache(max_sentences)
+        self.words = LRUCache(max_words)
+        if getattr(g2p, "fallback", None) is not None:
+            g2p.fallback = CachedFallback(g2p.fallback, self.words)
+
+    def __call__(self, text, *args, **kwargs):
+        if args or kwargs:
+            return self.g2p(text, *args, **kwargs)
+        cached = self.sentences.get(text)
+        if cached is None:
+            cached = self.g2p(text)
+            self.sentences.put(text, copy.deepcopy(cached))
+            return cached
+        return copy.deepcopy(cached)
+
+    # Everything else goes to the wrapped G2P
+    def __getattr__(self, name):
+        return getattr(self.g2p, name)
+
+    def stats(self):
+        return {"sentences": self.sentences.stats(), "words": self.words.stats()}
+
+# Word level cache around misaki's espeak fallback, which only looks at the token's text
+class CachedFallback:
+    def __init__(self, fallback, cache):
+        self.fallback = fallback
+        self.cache = cache
+
+    def __call__(self, token):
+        cached = self.cache.get(token.text)
+        if cached is None:
+            cached = self.fallback(token)
+            self.cache.put(token.text, cached)
+        return cached
+
+# Preload voice packs into a Kokoro pipeline and count how often a sentence finds its voice already
+# loaded, so switching voice never pays for loading the pack on the first sentence
+class VoicePacks:
+    def __init__(self, pipeline, voices):
+        self.load_voice = pipeline.load_voice
+        self.voices = pipeline.voices
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        for voice in voices:
+            self.load_voice(voice)
+        pipeline.load_voice = self
+
+    def __call__(self, voice, *args, **kwargs):
+        with self.lock:
+            if isinstance(voice, str) and voice in self.voices:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return self.load_voice(voice, *args, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"loaded": len(self.voices), "hits": self.hits, "misses": self.misses, "hit rate": self.hits / lookups if lookups else 0.0}
+
+# Set up a freshly built Kokoro pipeline: preload voices and put the phoneme cache in front of its G2P
+def prepare_kokoro_pipeline(pipeline, voices, max_sentences=4096, max_words=16384):
+    VoicePacks(pipeline, voices)
+    pipeline.g2p = CachedG2P(pipeline.g2p, max_sentences, max_words)
+    return pipeline
+
+# Phoneme and voice pack cache stats of a pipeline set up by prepare_kokoro_pipeline, None otherwise
+def kokoro_cache_stats(pipeline):
+    g2p = getattr(pipeline, "g2p", None)
+    if not isinstance(g2p, CachedG2P):
+        return None
+    stats = g2p.stats()
+    if isinstance(getattr(pipeline, "load_voice", None), VoicePacks):
+        stats["voice packs"] = pipeline.load_voice.stats()
+    return stats
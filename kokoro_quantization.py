@@ -0,0 +1,59 @@
+import numpy as np
+
+# Optimized CPU variants of Kokoro, chosen by model name: "kokoro-int8" is Kokoro with int8 dynamic
+# quantization. The weights of its Linear and LSTM layers (ALBERT, the duration and prosody predictor, the
+# text encoder and the decoder's style projections) are stored as int8 and activations are quantized on
+# the fly, so the model keeps its interface and everything that drives a KPipeline works unchanged. The
+# decoder's convolutions stay fp32, and so does the harmonic source's tiny Linear, whose output sets the
+# pitch of the whole waveform
+
+variants = ("int8",)
+
+# The variant a model name asks for, None for plain Kokoro
+def kokoro_variant(model_name):
+    for variant in variants:
+        if model_name.lower().endswith(f"-{variant}"):
+            return variant
+    return None
+
+# Quantize the model of a Kokoro pipeline in place
+def quantize_kokoro(pipeline, variant="int8"):
+    import torch
+    if variant != "int8":
+        raise ValueError(f"Unknown Kokoro variant {variant}")
+    model = pipeline.model
+    spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, (torch.nn.Linear, torch.nn.LSTM)) and not name.startswith("decoder.generator.m_source")
+    }
+    torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8, inplace=True)
+    # Kokoro calls flatten_parameters before each LSTM, quantized LSTMs keep their weights packed already
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.LSTM):
+            module.flatten_parameters = lambda: None
+    return pipeline
+
+# How far a variant's waveform is from the fp32 waveform of the same sentence. Quantization can change the
+# predicted durations, so the audio is compared as log-magnitude spectrograms over the frames both have,
+# and sample by sample only when the lengths match
+def waveform_difference(reference, candidate, frame_length=1024, hop=256, dynamic_range_db=60):
+    reference, candidate = (np.asarray(wav, dtype=np.float32) / (32768 if np.asarray(wav).dtype == np.int16 else 1)
+                            for wav in (reference, candidate))
+    difference = {"length ratio": len(candidate) / len(reference) if len(reference) else None}
+    if len(reference) == len(candidate) and len(reference):
+        noise = np.sum((reference - candidate) ** 2)
+        difference["snr db"] = float(10 * np.log10(np.sum(reference ** 2) / noise)) if noise > 0 else float("inf")
+    length = min(len(reference), len(candidate))
+    if length >= frame_length:
+        window = np.hanning(frame_length).astype(np.float32)
+
+        def log_spectrogram(wav):
+            frames = np.lib.stride_tricks.sliding_window_view(wav[:length], frame_length)[::hop] * window
+            return 20 * np.log10(np.abs(np.fft.rfft(frames)) + 1e-5)
+        # Bins more than dynamic_range_db under the loudest are floored, or near-silent bins would dominate
+        reference_spectrogram, candidate_spectrogram = log_spectrogram(reference), log_spectrogram(candidate)
+        floor = reference_spectrogram.max() - dynamic_range_db
+        distance = np.sqrt(np.mean((np.maximum(reference_spectrogram, floor) - np.maximum(candidate_spectrogram, floor)) ** 2, axis=1))
+        difference["log spectral distance db"] = float(np.mean(distance))
+    return difference
@@ -0,0 +1,198 @@
+import json, os, time
+import numpy as np
+from threading import Condition, Lock, Thread
+
+# Append-only columnar binary latency log. Each table is a directory with one file per column, holding
+# fixed-width little endian values after a short header that describes them. A run can be memory-mapped
+# into NumPy arrays a column at a time without parsing anything, and reading one column (every synthesis
+# start, say) only touches that column's file. A killed process loses at most the last flush interval.
+# Text (sentences, session ids, metric names) goes to strings.bin and rows hold its offset and length.
+#
+#  sentences/     one row per sentence once it has played, with the time of every stage in ms
+#  measurements/  one row per record_metric call, what the testing logs JSON is rebuilt from
+#
+# read_latency_log maps a run's columns and to_testing_logs converts it to the testing_logs.json layout
+
+magic = b"SLATLOG1"
+string_fields = [("offset", "<u8"), ("length", "<i4")]  # length -1 for no string
+
+sentence_dtype = np.dtype([
+    ("session offset", "<u8"), ("session length", "<i4"),
+    ("text offset", "<u8"), ("text length", "<i4"),
+    ("sid", "<i4"),
+    ("speech start", "<f8"), ("speech end", "<f8"),
+    ("queued at", "<f8"), ("synthesis start", "<f8"), ("first audio", "<f8"), ("synthesis end", "<f8"),
+    ("playback start", "<f8"), ("playback end", "<f8"),
+    ("speed", "<f4"), ("audio samples", "<u4")
+])
+
+measurement_dtype = np.dtype([
+    ("name offset", "<u8"), ("name length", "<i4"),
+    ("key offset", "<u8"), ("key length", "<i4"),
+    ("timestamp", "<f8"), ("value", "<f8"), ("extra", "<f8")
+])
+
+tables = {"sentences": sentence_dtype, "measurements": measurement_dtype}
+
+# Header: magic, the length of the JSON that follows, then JSON describing the column, padded to 8 bytes
+def encode_header(name, dtype):
+    description = json.dumps({"column": name, "dtype": dtype.str}).encode("utf-8")
+    description += b" " * (-(len(magic) + 4 + len(description)) % 8)
+    return magic + len(description).to_bytes(4, "little") + description
+
+def decode_header(f):
+    if f.read(len(magic)) != magic:
+        raise ValueError(f"{f.name} is not a latency log")
+    length = int.from_bytes(f.read(4), "little")
+    description = json.loads(f.read(length))
+    return description["column"], np.dtype(description["dtype"]), len(magic) + 4 + length
+
+def column_path(directory, table, name):
+    return os.path.join(directory, table, name.replace(" ", "_") + ".bin")
+
+# Writer for one run. Rows are buffered in memory and appended column by column by a background thread
+# every flush_seconds, strings first so no row on disk refers to text that isn't
+class LatencyLog:
+    def __init__(self, directory, flush_seconds=1.0):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.files = {}  # table -> column name -> file
+        for table, dtype in tables.items():
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+            self.files[table] = {}
+            for name in dtype.names:
+                path = column_path(directory, table, name)
+                new = not os.path.exists(path) or os.path.getsize(path) == 0
+                self.files[table][name] = open(path, "ab")
+                if new:
+                    # Flushed now so a run killed before its first row still has readable, empty columns
+                    self.files[table][name].write(encode_header(name, dtype.fields[name][0]))
+                    self.files[table][name].flush()
+        self.strings_file = open(os.path.join(directory, "strings.bin"), "ab")
+        self.strings_size = self.strings_file.tell()
+        self.cond = Condition()
+        self.write_lock = Lock()
+        self.pending = {table: [] for table in tables}
+        self.pending_strings = []
+        self.interned = {}  # names and session ids repeat, their text is only stored once
+        self.closed = False
+        Thread(target=self._flush_worker, daemon=True).start()
+
+    # Offset and length of text in strings.bin, queued for the next flush. Call with cond held
+    def _string(self, text, intern=False):
+        if text is None:
+            return 0, -1
+        if intern and text in self.interned:
+            return self.interned[text]
+        data = text.encode("utf-8")
+        reference = (self.strings_size, len(data))
+        self.strings_size += len(data)
+        self.pending_strings.append(data)
+        if intern:
+            self.interned[text] = reference
+        return reference
+
+    # A sentence that has finished playing. timings holds its stages in ms, missing ones are stored as NaN
+    def sentence(self, session_id, sid, text, timings):
+        with self.cond:
+            self.pending["sentences"].append((
+                *self._string(session_id, intern=True), *self._string(text), sid,
+                *(timings.get(stage, np.nan) for stage in ("speech start", "speech end", "queued at", "synthesis start",
+                                                           "first audio", "synthesis end", "playback start", "playback end")),
+                timings.get("speed", np.nan), timings.get("audio samples", 0)
+            ))
+
+    # A measurement as passed to record_metric, a tuple value keeps its second element as extra
+    def measurement(self, name, value, key=None):
+        value, extra = (value[0], value[1]) if isinstance(value, tuple) else (value, np.nan)
+        with self.cond:
+            self.pending["measurements"].append((*self._string(name, intern=True), *self._string(key), time.time() * 1000, value, extra))
+
+    # Records are taken under cond and written after releasing it, record_metric runs in audio callbacks and
+    # must not wait on the disk. write_lock keeps flushes in order so strings still land before their records
+    def flush(self):
+        with self.write_lock:
+            with self.cond:
+                strings, self.pending_strings = self.pending_strings, []
+                pending, self.pending = self.pending, {table: [] for table in tables}
+                if self.closed:
+                    return
+            if strings:
+                self.strings_file.write(b"".join(strings))
+                self.strings_file.flush()
+            for table, records in pending.items():
+                if records:
+                    rows = np.array(records, dtype=tables[table])
+                    for name, f in self.files[table].items():
+                        f.write(np.ascontiguousarray(rows[name]).tobytes())
+                        f.flush()
+
+    def _flush_worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait(self.flush_seconds)
+                if self.closed:
+                    return
+            self.flush()
+
+    def close(self):
+        self.flush()
+        with self.write_lock, self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            for f in (*(f for columns in self.files.values() for f in columns.values()), self.strings_file):
+                f.close()
+
+# Map a run's tables as dicts of read only column arrays. Columns are cut to the rows every column has,
+# so a row a crash left half written is left out, and an empty column file has no rows
+def read_latency_log(directory):
+    run = {}
+    for table, dtype in tables.items():
+        columns = {}
+        for name in dtype.names:
+            path = column_path(directory, table, name)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                # Killed before the header reached the disk, no rows
+                columns[name] = np.zeros(0, dtype=dtype.fields[name][0])
+                continue
+            with open(path, "rb") as f:
+                column, column_dtype, offset = decode_header(f)
+            count = (os.path.getsize(path) - offset) // column_dtype.itemsize
+            columns[column] = np.memmap(path, dtype=column_dtype, mode="r", offset=offset, shape=(count,)) if count else np.zeros(0, dtype=column_dtype)
+        rows = min(len(values) for values in columns.values())
+        run[table] = {name: values[:rows] for name, values in columns.items()}
+    strings_path = os.path.join(directory, "strings.bin")
+    run["strings"] = np.memmap(strings_path, dtype=np.uint8, mode="r") if os.path.exists(strings_path) and os.path.getsize(strings_path) else np.zeros(0, dtype=np.uint8)
+    return run
+
+# Number of rows in a table read by read_latency_log
+def table_length(table):
+    return len(next(iter(table.values())))
+
+# Text of a string reference, None for no string or text lost in a crash
+def read_string(strings, offset, length):
+    if length < 0 or offset + length > len(strings):
+        return None
+    return bytes(strings[offset:offset + length]).decode("utf-8")
+
+# A run's measurements in the layout of testing_logs.json: a list of values per measurement, or a dict from
+# sentence text to the latest value for the ones recorded with a key
+def to_testing_logs(directory):
+    run = read_latency_log(directory)
+    strings = run["strings"]
+    measurements = run["measurements"]
+    logs = {}
+    names = {}
+    columns = zip(measurements["name offset"].tolist(), measurements["name length"].tolist(), measurements["key offset"].tolist(),
+                  measurements["key length"].tolist(), measurements["value"].tolist(), measurements["extra"].tolist())
+    for name_offset, name_length, key_offset, key_length, value, extra in columns:
+        if (name_offset, name_length) not in names:
+            names[(name_offset, name_length)] = read_string(strings, name_offset, name_length)
+        name = names[(name_offset, name_length)]
+        if not np.isnan(extra):
+            value = [value, extra]
+        if key_length < 0:
+            logs.setdefault(name, []).append(value)
+        else:
+            logs.setdefault(name, {})[read_string(strings, key_offset, key_length)] = value
+    return logs
@@ -0,0 +1,137 @@
+import math, re
+from bisect import insort
+from threading import Lock
+
+# Histogram with fixed log spaced buckets, memory stays the same however many values are observed.
+# Buckets are keyed by a signed index so negative values (clock skew between machines) are kept too.
+# Quantiles are accurate to within one bucket, about 12% with 20 buckets per decade
+class StreamingHistogram:
+    def __init__(self, min_value=0.01, max_value=1e7, buckets_per_decade=20):
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        self.max_index = 1 + int(math.log10(max_value / min_value) * buckets_per_decade)
+        self.counts = {}  # bucket index -> count
+        self.keys = []  # sorted bucket indexes
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        magnitude = abs(value)
+        if magnitude < self.min_value:
+            return 0
+        index = min(self.max_index, 1 + int(math.log10(magnitude / self.min_value) * self.buckets_per_decade))
+        return index if value > 0 else -index
+
+    def _bucket_value(self, index):
+        if index == 0:
+            return 0.0
+        value = self.min_value * 10 ** ((abs(index) - 0.5) / self.buckets_per_decade)
+        return value if index > 0 else -value
+
+    def observe(self, value):
+        index = self._index(value)
+        if index not in self.counts:
+            self.counts[index] = 0
+            insort(self.keys, index)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in self.keys:
+            seen += self.counts[index]
+            if seen > rank:
+                return min(self.max, max(self.min, self._bucket_value(index)))
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+# Registry of the server's live metrics: histograms for timings and sizes, counters and gauges
+class Metrics:
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, prefix="synthesis"):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.histograms = {}  # name -> (unit, StreamingHistogram)
+        self.counters = {}
+        self.gauges = {}  # name -> value or a function returning it
+
+    def observe(self, name, value, unit="ms"):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = (unit, StreamingHistogram())
+            self.histograms[name][1].observe(value)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def histogram(self, name):
+        with self.lock:
+            return self.histograms[name][1] if name in self.histograms else StreamingHistogram()
+
+    def _metric_name(self, name, unit=""):
+        slug = re.sub(r"[^a-zA-Z0-9]+", "_", name).strip("_").lower()
+        return f"{self.prefix}_{slug}_{unit}" if unit else f"{self.prefix}_{slug}"
+
+    @staticmethod
+    def _gauge_value(value):
+        return value() if callable(value) else value
+
+    # Summary of every metric as a dict, for JSON export
+    def snapshot(self):
+        with self.lock:
+            histograms = {name: (unit, histogram) for name, (unit, histogram) in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        summary = {}
+        for name, (unit, histogram) in histograms.items():
+            summary[name] = {
+                "unit": unit,
+                "count": histogram.count,
+                "mean": histogram.mean(),
+                "min": histogram.min,
+                "max": histogram.max,
+                **{f"p{int(q * 100)}": histogram.quantile(q) for q in self.quantiles}
+            }
+        summary.update(counters)
+        summary.update({name: self._gauge_value(value) for name, value in gauges.items()})
+        return summary
+
+    # Every metric in the Prometheus text exposition format, histograms as summaries with p50/p95/p99
+    def prometheus(self):
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+        lines = []
+        for name, (unit, histogram) in histograms:
+            metric = self._metric_name(name, unit)
+            lines.append(f"# TYPE {metric} summary")
+            for q in self.quantiles:
+                lines.append(f'{metric}{{quantile="{q}"}} {histogram.quantile(q)}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.count}")
+        for name, value in counters:
+            metric = self._metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in gauges:
+            metric = self._metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {self._gauge_value(value)}")
+        return "\n".join(lines) + "\n"
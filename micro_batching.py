@@ -0,0 +1,180 @@
+import time
+from threading import Condition
+
+# Micro-batching of Kokoro synthesis across concurrent sentences. Synthesis workers hand their phoneme
+# chunks to a shared MicroBatcher instead of calling the model one sentence at a time. Chunks that arrive
+# within a short window of each other go through the model as one padded batch and each worker gets back
+# the audio of its own chunk, so which sentence publishes what (and in which order) is unchanged.
+#
+# Only the text side of the model (PL-BERT, the duration predictor and the text encoder) runs as a batch,
+# with real lengths and masks so padding doesn't change the result. The prosody predictor and decoder
+# normalize over time and run per chunk on the batched features, finished chunks are handed back while
+# the rest of the batch is still decoding
+
+# Whether a pipeline's chunks can go through batched_forward, true for English Kokoro pipelines
+def supports_batching(pipeline):
+    return getattr(pipeline, "lang_code", None) in ("a", "b") and hasattr(getattr(pipeline, "model", None), "forward_with_tokens")
+
+# Phoneme chunks of text, split the way KPipeline splits them
+def phoneme_chunks(pipeline, text):
+    _, tokens = pipeline.g2p(text)
+    for _, phonemes, _ in pipeline.en_tokenize(tokens):
+        if phonemes:
+            yield phonemes[:510]
+
+# Run a batch of (phonemes, style vector, speed) through a KModel, yielding (index, audio) as each one is
+# decoded. Follows KModel.forward_with_tokens, with the padding masked out of the text side
+def batched_forward(model, items):
+    import torch
+    from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+    ids = [[0, *[i for i in map(model.vocab.get, phonemes) if i is not None], 0] for phonemes, _, _ in items]
+    input_lengths = torch.tensor([len(row) for row in ids], dtype=torch.long)
+    max_length = int(input_lengths.max())
+    input_ids = torch.zeros((len(ids), max_length), dtype=torch.long)
+    for row, token_ids in enumerate(ids):
+        input_ids[row, :len(token_ids)] = torch.tensor(token_ids, dtype=torch.long)
+    input_ids = input_ids.to(model.device)
+    text_mask = torch.gt(torch.arange(max_length).unsqueeze(0) + 1, input_lengths.unsqueeze(1)).to(model.device)
+    ref_s = torch.cat([style.reshape(1, -1) for _, style, _ in items]).to(model.device)
+    speeds = torch.tensor([float(speed) for _, _, speed in items], device=model.device).unsqueeze(1)
+
+    with torch.no_grad():
+        bert_dur = model.bert(input_ids, attention_mask=(~text_mask).int())
+        d_en = model.bert_encoder(bert_dur).transpose(-1, -2)
+        s = ref_s[:, 128:]
+        d = model.predictor.text_encoder(d_en, s, input_lengths, text_mask)
+        # The duration LSTM is bidirectional, packed so the padding doesn't leak into the backward pass
+        x = pack_padded_sequence(d, input_lengths, batch_first=True, enforce_sorted=False)
+        x, _ = model.predictor.lstm(x)
+        x, _ = pad_packed_sequence(x, batch_first=True, total_length=max_length)
+        duration = torch.sigmoid(model.predictor.duration_proj(x)).sum(axis=-1) / speeds
+        t_en = model.text_encoder(input_ids, input_lengths, text_mask)
+
+        for row in range(len(items)):
+            length = int(input_lengths[row])
+            pred_dur = torch.round(duration[row, :length]).clamp(min=1).long()
+            indices = torch.repeat_interleave(torch.arange(length, device=model.device), pred_dur)
+            pred_aln_trg = torch.zeros((length, indices.shape[0]), device=model.device)
+            pred_aln_trg[indices, torch.arange(indices.shape[0])] = 1
+            pred_aln_trg = pred_aln_trg.unsqueeze(0)
+            en = d[row:row + 1, :length].transpose(-1, -2) @ pred_aln_trg
+            F0_pred, N_pred = model.predictor.F0Ntrain(en, s[row:row + 1])
+            asr = t_en[row:row + 1, :, :length] @ pred_aln_trg
+            audio = model.decoder(asr, F0_pred, N_pred, ref_s[row:row + 1, :128]).squeeze()
+            yield row, audio.cpu().numpy()
+
+# A phoneme chunk waiting for its audio
+class BatchRequest:
+    def __init__(self, model, phonemes, style, speed):
+        self.model = model
+        self.phonemes = phonemes
+        self.style = style
+        self.speed = speed
+        self.queued_at = time.perf_counter()
+        self.audio = None
+        self.error = None
+        self.done = False
+
+# Collects the chunks synthesis workers submit and runs them through the model in batches, one batch at
+# a time. The first waiting worker leads the next batch: it waits up to window_ms after the oldest chunk
+# for others to arrive, runs the batch and hands out the results. Chunks that arrive while a batch is
+# running make up the next one. The batch size adapts to the measured time per chunk so a batch takes at
+# most max_latency_ms, which bounds how long the chunk at the head of the queue waits behind it
+class MicroBatcher:
+    def __init__(self, window_ms=5, max_batch_size=8, max_latency_ms=300):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.cond = Condition()
+        self.pending = []  # requests in arrival order
+        self.running = False  # a worker is running a batch
+        self.seconds_per_chunk = None  # moving average of batch time per chunk
+        self.batches = 0
+        self.batched_chunks = 0
+        self.largest_batch = 0
+
+    # Largest batch expected to finish within max_latency_ms
+    def batch_size(self):
+        if self.seconds_per_chunk is None:
+            return 1
+        budget = self.max_latency - self.window
+        return max(1, min(self.max_batch_size, int(budget / self.seconds_per_chunk)))
+
+    # Generator of the audio for text, one array per phoneme chunk like the pipeline yields them
+    def synthesize(self, pipeline, text, voice, speed):
+        model = pipeline.model
+        pack = pipeline.load_voice(voice).to(model.device)
+        for phonemes in phoneme_chunks(pipeline, text):
+            yield self.run(BatchRequest(model, phonemes, pack[len(phonemes) - 1], speed))
+
+    # Submit a chunk and wait for its audio, leading a batch when no one else is
+    def run(self, request):
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify_all()
+            while not request.done:
+                if self.running or request not in self.pending:
+                    self.cond.wait()
+                    continue
+                self.running = True
+                batch = self._collect()
+                self.cond.release()
+                try:
+                    self._run_batch(batch)
+                finally:
+                    self.cond.acquire()
+                    self.running = False
+                    self.cond.notify_all()
+        if request.error is not None:
+            raise request.error
+        return request.audio
+
+    # Wait out the window for the next batch and take it from pending. Call with cond held and running set
+    def _collect(self):
+        size = self.batch_size()
+        deadline = self.pending[0].queued_at + self.window
+        while len(self.pending) < size and time.perf_counter() < deadline:
+            self.cond.wait(deadline - time.perf_counter())
+        # Chunks queued for a model that has just been swapped out wait for a batch of their own
+        model = self.pending[0].model
+        batch = [request for request in self.pending if request.model is model][:size]
+        for request in batch:
+            self.pending.remove(request)
+        return batch
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            for row, audio in batched_forward(batch[0].model, [(r.phonemes, r.style, r.speed) for r in batch]):
+                with self.cond:
+                    batch[row].audio = audio
+                    batch[row].done = True
+                    self.cond.notify_all()
+        except Exception as e:
+            with self.cond:
+                for request in batch:
+                    if not request.done:
+                        request.error = e
+                        request.done = True
+                self.cond.notify_all()
+            return
+        seconds_per_chunk = (time.perf_counter() - start) / len(batch)
+        with self.cond:
+            self.batches += 1
+            self.batched_chunks += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            if self.seconds_per_chunk is None:
+                self.seconds_per_chunk = seconds_per_chunk
+            else:
+                self.seconds_per_chunk = 0.8 * self.seconds_per_chunk + 0.2 * seconds_per_chunk
+
+    def stats(self):
+        with self.cond:
+            return {
+                "batches": self.batches,
+                "chunks": self.batched_chunks,
+                "mean batch size": self.batched_chunks / self.batches if self.batches else 0.0,
+                "largest batch": self.largest_batch,
+                "batch size limit": self.batch_size(),
+                "ms per chunk": self.seconds_per_chunk * 1000 if self.seconds_per_chunk is not None else None
+            }
@@ -0,0 +1,98 @@
+import gc
+from collections import OrderedDict
+from threading import Lock
+
+# Size of a model's weights in bytes, from the torch module inside a Kokoro pipeline or a Coqui TTS object
+def model_size_bytes(model):
+    candidates = (getattr(model, "model", None), getattr(getattr(model, "synthesizer", None), "tts_model", None), model)
+    for module in candidates:
+        if module is not None and hasattr(module, "parameters"):
+            return sum(p.numel() * p.element_size() for p in module.parameters())
+    return 0
+
+# A loaded model and the synthesis jobs using it
+class LoadedModel:
+    def __init__(self, name, model_type, model):
+        self.name = name
+        self.model_type = model_type  # 'coqui' or 'kokoro'
+        self.model = model
+        self.size_bytes = model_size_bytes(model)
+        self.refcount = 0  # jobs synthesizing with it
+        self.evicted = False  # freed as soon as the last job using it finishes
+
+    def free(self):
+        self.model = None
+        gc.collect()
+
+# Models kept resident so switching between them doesn't reload. One model is active, new synthesis jobs
+# acquire it and release it when they finish. A new model is loaded and warmed next to the active one and
+# swapped in atomically, jobs already running finish on the model they started with. Models that aren't
+# active are evicted least recently used first once the resident models go over max_bytes or max_models
+class ModelRegistry:
+    def __init__(self, max_bytes, max_models=None):
+        self.max_bytes = max_bytes
+        self.max_models = max_models
+        self.lock = Lock()
+        self.models = OrderedDict()  # name -> LoadedModel, least recently active first
+        self.active = None
+
+    # Make a model active, building it with loader() -> (model type, model) when it isn't resident.
+    # Loading happens outside the lock so synthesis carries on with the active model meanwhile.
+    # Returns True if the model had to be loaded
+    def activate(self, name, loader):
+        with self.lock:
+            entry = self.models.get(name)
+        loaded = entry is None
+        if loaded:
+            model_type, model = loader()
+            entry = LoadedModel(name, model_type, model)
+        with self.lock:
+            self.models[name] = entry
+            self.models.move_to_end(name)
+            self.active = entry
+            evicted = self._evict()
+        for old in evicted:
+            old.free()
+        return loaded
+
+    # Remove models past the budget, returns the ones nothing is using any more. Call with lock held
+    def _evict(self):
+        evicted = []
+        for name in list(self.models):
+            if self.resident_bytes() <= self.max_bytes and (self.max_models is None or len(self.models) <= self.max_models):
+                break
+            entry = self.models[name]
+            if entry is self.active:
+                continue
+            del self.models[name]
+            entry.evicted = True
+            if entry.refcount == 0:
+                evicted.append(entry)
+        return evicted
+
+    def resident_bytes(self):
+        return sum(entry.size_bytes for entry in self.models.values())
+
+    # The active model for a synthesis job, None when nothing is loaded. Pass it to release when done
+    def acquire(self):
+        with self.lock:
+            entry = self.active
+            if entry is not None:
+                entry.refcount += 1
+            return entry
+
+    def release(self, entry):
+        with self.lock:
+            entry.refcount -= 1
+            free = entry.evicted and entry.refcount == 0
+        if free:
+            entry.free()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": self.active.name if self.active is not None else None,
+                "resident": {name: {"bytes": entry.size_bytes, "jobs": entry.refcount} for name, entry in self.models.items()},
+                "resident bytes": self.resident_bytes(),
+                "max bytes": self.max_bytes
+            }
@@ -0,0 +1,185 @@
+import argparse, json, os, subprocess, sys, time, wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from segmenter import IncrementalSegmenter
+from synthesis_processes import SynthesisProcessPool
+
+# Offline batch rendering, without the server or real time playback. Text files are split into sentences by
+# the server's segmenter and synthesized across worker processes by its process backend, then written to
+# WAV or Ogg Opus in order. Only --window sentences are in flight or waiting to be written at a time, so
+# memory stays bounded however long the input is. Reports the real time factor overall and per core.
+#  python render.py tests/annotated_transcript.txt --output-dir ./renders --model kokoro --workers 4
+#  python render.py prompts/ --format opus --output-dir ./renders/prompts
+
+SAMPLE_RATE = 24000
+
+class WavWriter:
+    def __init__(self, path):
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(SAMPLE_RATE)
+
+    def write(self, wav):
+        self.file.writeframes(wav.tobytes())
+
+    def close(self):
+        self.file.close()
+
+# Encodes with ffmpeg's libopus, the same encoder as the opus audio sink
+class OpusWriter:
+    def __init__(self, path, bitrate="32k"):
+        self.encoder = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", bitrate, "-application", "voip", "-f", "ogg", path],
+            stdin=subprocess.PIPE
+        )
+
+    def write(self, wav):
+        self.encoder.stdin.write(wav.tobytes())
+
+    def close(self):
+        self.encoder.stdin.close()
+        self.encoder.wait()
+
+# The .txt files to render as (path, output name without extension). A directory is rendered file by file in
+# name order, into a directory of the same name under the output directory
+def input_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            directory = os.path.basename(os.path.normpath(path))
+            files.extend((os.path.join(path, name), os.path.join(directory, os.path.splitext(name)[0]))
+                         for name in sorted(os.listdir(path)) if name.endswith(".txt"))
+        else:
+            files.append((path, os.path.splitext(os.path.basename(path))[0]))
+    return files
+
+# Sentences of a text file, split by the server's segmenter. The file is read a line at a time and fed to the
+# segmenter a few words at a time, so nothing holds the whole text. Without a live stream to keep up with,
+# only sentences longer than max_words are split at clauses
+def sentences(path, words_per_fragment=32, max_words=40):
+    segmenter = IncrementalSegmenter(max_words=max_words)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            words = line.split()
+            for i in range(0, len(words), words_per_fragment):
+                segmenter.append(" ".join(words[i:i + words_per_fragment]), 0)
+                while (sentence := segmenter.next_segment(0)) is not None:
+                    yield sentence
+    while segmenter.text:
+        sentence = segmenter.next_segment(0) or segmenter.flush()
+        if sentence:
+            yield sentence
+
+def render_sentence(pool, text, voice, speed, speaker_wav):
+    wavs = list(pool.synthesize(text, voice, speed, speaker_wav))
+    return np.concatenate(wavs) if wavs else np.zeros(0, dtype=np.int16)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render text files to audio with the synthesis pipeline, using every core")
+    parser.add_argument("inputs", nargs="+", help="text files or directories of .txt files")
+    parser.add_argument("--output-dir", default="./renders", help="directory the audio files are written to")
+    parser.add_argument("--format", choices=("wav", "opus"), default="wav")
+    parser.add_argument("--bitrate", default="32k", help="Opus bitrate")
+    parser.add_argument("--model", default="kokoro", help="kokoro, a Coqui model name, or fake")
+    parser.add_argument("--voice", default="af_heart", help="Kokoro voice")
+    parser.add_argument("--speed", type=float, default=1.0, help="Kokoro speed")
+    parser.add_argument("--speaker-wav", default="./audio/johns_voice.wav", help="reference wav for Coqui voice cloning")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="synthesis processes")
+    parser.add_argument("--torch-threads", type=int, help="torch threads per process, cores / workers by default")
+    parser.add_argument("--window", type=int, default=0, help="most sentences in flight or waiting to be written, 4 x workers by default")
+    parser.add_argument("--report", help="file to write the timing report to as JSON")
+    args = parser.parse_args()
+
+    files = input_files(args.inputs)
+    if not files:
+        sys.exit("Nothing to render.")
+    names = [name for _, name in files]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        sys.exit(f"Inputs would overwrite each other's output: {', '.join(duplicates)}")
+    cores = os.cpu_count() or 1
+    torch_threads = args.torch_threads or max(1, cores // args.workers)
+    window = args.window or 4 * args.workers
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    pool = SynthesisProcessPool(args.workers, torch_threads)
+    load_start = time.perf_counter()
+    pool.load(args.model, None, (args.voice,))
+    print(f"Loaded {args.model} in {args.workers} processes x {torch_threads} threads in {time.perf_counter() - load_start:.1f} s")
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    pending = deque()  # (file report, future) in output order, None for the end of a file
+    reports = []
+    failed = 0
+
+    # Write the oldest sentence in flight once it is done, or finish its file
+    def write_next():
+        nonlocal failed
+        report, future = pending.popleft()
+        if future is None:
+            report["writer"].close()
+            report["wall seconds"] = time.perf_counter() - report.pop("started")
+            del report["writer"]
+            print(f"  {report['output']}: {report['sentences']} sentences, {report['audio seconds']:.1f} s of audio "
+                  f"in {report['wall seconds']:.1f} s")
+            return
+        try:
+            wav = future.result()
+        except Exception as e:
+            failed += 1
+            print(f"  Synthesis failed: {e}")
+            return
+        report["writer"].write(wav)
+        report["audio seconds"] += len(wav) / SAMPLE_RATE
+
+    start = time.perf_counter()
+    for path, name in files:
+        output = os.path.join(args.output_dir, f"{name}.{args.format}")
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        writer = WavWriter(output) if args.format == "wav" else OpusWriter(output, args.bitrate)
+        report = {"input": path, "output": output, "sentences": 0, "audio seconds": 0.0, "writer": writer, "started": time.perf_counter()}
+        reports.append(report)
+        for sentence in sentences(path):
+            while len(pending) >= window:
+                write_next()
+            pending.append((report, executor.submit(render_sentence, pool, sentence, args.voice, args.speed, args.speaker_wav)))
+            report["sentences"] += 1
+        pending.append((report, None))
+    while pending:
+        write_next()
+    wall_seconds = time.perf_counter() - start
+    executor.shutdown()
+    pool.close()
+
+    audio_seconds = sum(report["audio seconds"] for report in reports)
+    cores_used = min(cores, args.workers * torch_threads)
+    # Real time factor: seconds of compute per second of audio, per core it is core-seconds per audio second
+    rtf = wall_seconds / audio_seconds if audio_seconds else None
+    summary = {
+        "model": args.model,
+        "workers": args.workers,
+        "torch threads": torch_threads,
+        "cores used": cores_used,
+        "files": reports,
+        "sentences": sum(report["sentences"] for report in reports),
+        "failed sentences": failed,
+        "audio seconds": audio_seconds,
+        "wall seconds": wall_seconds,
+        "real time factor": rtf,
+        "real time factor per core": rtf * cores_used if rtf is not None else None,
+        "audio seconds per second": audio_seconds / wall_seconds if wall_seconds else None
+    }
+    if rtf is not None:
+        print(f"{audio_seconds:.1f} s of audio in {wall_seconds:.1f} s: real time factor {rtf:.3f}, "
+              f"{rtf * cores_used:.3f} per core over {cores_used} cores ({audio_seconds / wall_seconds:.1f}x real time)")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=4)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
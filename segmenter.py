@@ -0,0 +1,137 @@
+import re
+
+# Titles that come before a name, a full stop after one never ends a sentence
+TITLES = {"dr", "mr", "mrs", "ms", "prof", "rev", "hon", "gen", "gov", "lt", "col", "capt", "sgt", "mt", "vs", "e.g", "i.e"}
+# Abbreviations that can also end a sentence ("no", "co", months). Their full stop, like that of dotted
+# acronyms (U.S.A., a.m.) and single letters, is only not a boundary when the next word starts in lower
+# case or with a digit
+ABBREVIATIONS = {
+    "st", "sr", "jr", "etc", "approx", "dept", "est", "no", "fig", "inc", "ltd", "co", "corp",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec"
+}
+# Words a long fragment can be split in front of
+CONJUNCTIONS = {"and", "but", "or", "so", "because", "although", "though", "while", "whereas", "which", "unless", "until"}
+
+TERMINALS = ".!?"
+CLOSERS = ".!?\"')]"
+CLAUSE_PUNCTUATION = ",;:"
+
+word_pattern = re.compile(r"\S+")
+initial_pattern = re.compile(r"[\"'(]?[A-Z]\.$")
+
+# Splits a growing transcript into segments for synthesis. Keeps its scan position between calls so
+# text that has already been checked for a sentence boundary isn't searched again, splits long
+# fragments at clause boundaries and lets a stalled buffer be flushed after a deadline
+class IncrementalSegmenter:
+    def __init__(self, max_words=12, max_fragment_seconds=2.0, flush_seconds=1.5, min_clause_words=4):
+        self.max_words = max_words
+        self.max_fragment_seconds = max_fragment_seconds
+        self.flush_seconds = flush_seconds
+        self.min_clause_words = min_clause_words
+        self.text = ""
+        self.scan_pos = 0  # no sentence boundary before this index
+        self.fragment_started = None  # when the oldest text still in the buffer arrived
+        self.last_update = None  # when text was last appended
+
+    def append(self, text, now):
+        text = text.strip()
+        if not text:
+            return
+        self.text = f"{self.text} {text}" if self.text else text
+        if self.fragment_started is None:
+            self.fragment_started = now
+        self.last_update = now
+
+    # Remove and return the next ready segment, or None when the buffer should wait for more text
+    def next_segment(self, now):
+        end = self._find_sentence_end()
+        if end is None and self._fragment_too_long(now):
+            end = self._find_clause_end()
+        if end is None:
+            return None
+        return self._take(end)
+
+    # Remove and return everything in the buffer
+    def flush(self):
+        return self._take(len(self.text)) if self.text else None
+
+    # Time at which a stalled buffer should be flushed, None when empty
+    def flush_deadline(self):
+        return self.last_update + self.flush_seconds if self.text else None
+
+    def _take(self, end):
+        segment = self.text[:end].strip()
+        rest = self.text[end:]
+        self.text = rest.strip()
+        # Text left over has already been scanned up to scan_pos, keep that position in the shorter buffer
+        self.scan_pos = max(0, self.scan_pos - (end + len(rest) - len(rest.lstrip())))
+        self.fragment_started = self.last_update if self.text else None
+        if not self.text:
+            self.last_update = None
+        return segment or None
+
+    def _fragment_too_long(self, now):
+        if len(word_pattern.findall(self.text)) > self.max_words:
+            return True
+        return self.fragment_started is not None and now - self.fragment_started >= self.max_fragment_seconds
+
+    # Index just past the first real sentence boundary after scan_pos
+    def _find_sentence_end(self):
+        text = self.text
+        i = self.scan_pos
+        while i < len(text):
+            if text[i] in TERMINALS and self._is_boundary(i):
+                end = i + 1
+                while end < len(text) and text[end] in CLOSERS:
+                    end += 1
+                return end
+            i += 1
+        self.scan_pos = len(text)
+        return None
+
+    def _is_boundary(self, i):
+        text = self.text
+        if text[i] != ".":
+            return True
+        # Inside a token: decimals like 3.5, the inner dots of U.S.A. and a.m.
+        if i < len(text) - 1 and text[i + 1].isalnum():
+            return False
+        # Part of an ellipsis or a run of dots, the boundary is the last one
+        if i < len(text) - 1 and text[i + 1] == ".":
+            return False
+        word_start = i
+        while word_start > 0 and not text[word_start - 1].isspace():
+            word_start -= 1
+        word = text[word_start:i].strip("\"'(")
+        if word.lower() in TITLES:
+            return False
+        tokens_after = text[i + 1:].split(maxsplit=1)
+        # A chain of initials, as in "J. R. R. Tolkien", holds together up to and including its last initial
+        if len(word) == 1 and word.isupper():
+            tokens_before = text[:word_start].split()
+            if (tokens_after and initial_pattern.match(tokens_after[0])) or (tokens_before and initial_pattern.match(tokens_before[-1])):
+                return False
+        # Abbreviations, dotted acronyms and single letters only continue into a following word in lower case
+        # or a number, at the end of the buffer they are taken as the end of the sentence
+        if word.lower() in ABBREVIATIONS or "." in word.rstrip(".") or (len(word) == 1 and word.isalpha()):
+            next_word = tokens_after[0].lstrip("\"'(") if tokens_after else ""
+            return not (next_word and (next_word[0].islower() or next_word[0].isdigit()))
+        return True
+
+    # Index to split a long fragment at: the last clause boundary that keeps the head within max_words,
+    # or failing that the first one with at least min_clause_words before it
+    def _find_clause_end(self):
+        candidates = []
+        words = list(word_pattern.finditer(self.text))
+        for count, match in enumerate(words, start=1):
+            word = match.group()
+            if word[-1] in CLAUSE_PUNCTUATION:
+                candidates.append((count, match.end()))
+            elif count < len(words) and words[count].group().lower().strip(",;:") in CONJUNCTIONS:
+                candidates.append((count, match.end()))
+
+        candidates = [c for c in candidates if c[0] >= self.min_clause_words and c[0] < len(words)]
+        if not candidates:
+            return None
+        within_limit = [c for c in candidates if c[0] <= self.max_words]
+        return (within_limit[-1] if within_limit else candidates[0])[1]
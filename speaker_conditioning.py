@@ -0,0 +1,121 @@
+import os, hashlib
+from threading import Lock
+
+# Cache of the speaker conditioning XTTS computes from a reference wav (the GPT conditioning latents and
+# the speaker embedding). Computed once per model and reference file, kept in memory and saved to
+# cache_dir so restarts skip it too. Entries are keyed by a hash of the file's contents and the model
+# config's conditioning settings, so editing the reference wav or the settings computes new conditioning
+class SpeakerConditioningCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.entries = {}  # key -> (gpt_cond_latent, speaker_embedding)
+        self.file_hashes = {}  # (path, size, mtime) -> sha1 of the contents
+        self.lock = Lock()
+        self.compute_lock = Lock()  # one reference wav processed at a time
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # Hash of a file's contents, only read again when its size or modification time changes
+    def file_hash(self, path):
+        stat = os.stat(path)
+        stat_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self.file_hashes.get(stat_key)
+        if digest is None:
+            sha1 = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha1.update(block)
+            digest = sha1.hexdigest()
+            self.file_hashes[stat_key] = digest
+        return digest
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pt") if self.cache_dir else None
+
+    # Conditioning for speaker_wav on a Coqui TTS object, computed on the first call for each model and file
+    def get(self, tts, speaker_wav):
+        import torch
+        settings = conditioning_settings(tts.synthesizer.tts_model.config)
+        key = hashlib.sha1(f"{getattr(tts, 'model_name', '')}|{self.file_hash(speaker_wav)}|{sorted(settings.items())}".encode("utf-8")).hexdigest()
+        with self.lock:
+            conditioning = self.entries.get(key)
+            if conditioning is not None:
+                self.hits += 1
+                return conditioning
+
+        with self.compute_lock:
+            # Another thread may have computed it while this one waited
+            with self.lock:
+                conditioning = self.entries.get(key)
+                if conditioning is not None:
+                    self.hits += 1
+                    return conditioning
+
+            xtts = tts.synthesizer.tts_model
+            path = self._path(key)
+            if path is not None and os.path.exists(path):
+                saved = torch.load(path, map_location=xtts.device)
+                conditioning = (saved["gpt_cond_latent"], saved["speaker_embedding"])
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+            else:
+                conditioning = xtts.get_conditioning_latents(audio_path=[speaker_wav], **settings)
+                if path is not None:
+                    # Written under a temporary name so synthesis processes never load a partial file
+                    temp_path = f"{path}.{os.getpid()}.tmp"
+                    torch.save({"gpt_cond_latent": conditioning[0], "speaker_embedding": conditioning[1]}, temp_path)
+                    os.replace(temp_path, path)
+                with self.lock:
+                    self.misses += 1
+            with self.lock:
+                self.entries[key] = conditioning
+            return conditioning
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk hits": self.disk_hits,
+                "misses": self.misses,
+                "hit rate": self.hits / lookups if lookups else 0.0
+            }
+
+# Arguments Xtts.synthesize takes from the model config, so cached conditioning and decoding match tts()
+def conditioning_settings(config):
+    return {
+        "gpt_cond_len": config.gpt_cond_len,
+        "gpt_cond_chunk_len": config.gpt_cond_chunk_len,
+        "max_ref_length": config.max_ref_len,
+        "sound_norm_refs": config.sound_norm_refs
+    }
+
+def inference_settings(config):
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p
+    }
+
+# Whether a Coqui TTS object can be conditioned ahead of time, true for XTTS
+def supports_conditioning(tts):
+    return hasattr(getattr(getattr(tts, "synthesizer", None), "tts_model", None), "get_conditioning_latents")
+
+# Generator of the audio for text in the voice of speaker_wav. XTTS models run only the decoder pass per
+# sentence with the cached conditioning, other models go through tts() as before
+def clone_voice(tts, text, speaker_wav, cache):
+    if cache is None or not supports_conditioning(tts):
+        yield tts.tts(text=text, speaker_wav=speaker_wav, language="en")
+        return
+    gpt_cond_latent, speaker_embedding = cache.get(tts, speaker_wav)
+    xtts = tts.synthesizer.tts_model
+    settings = inference_settings(xtts.config)
+    for sentence in tts.synthesizer.split_into_sentences(text):
+        yield xtts.inference(sentence, "en", gpt_cond_latent, speaker_embedding, **settings)["wav"]
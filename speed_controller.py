@@ -0,0 +1,75 @@
+# Speed controllers decide the synthesis speed for each sentence from how far behind playback is.
+# A controller is used as choose_speed(...) before synthesis and observe(...) once the audio length is known
+
+
+# Predicts how long a voice takes to speak some text, as characters per second at speed 1.0.
+# Starts from a default rate and follows the measured rate of each voice with an exponential moving average
+class SpeakingRateModel:
+    def __init__(self, default_chars_per_second=15.0, smoothing=0.2):
+        self.default_chars_per_second = default_chars_per_second
+        self.smoothing = smoothing
+        self.rates = {}  # voice -> chars per second at speed 1.0
+
+    def chars_per_second(self, voice):
+        return self.rates.get(voice, self.default_chars_per_second)
+
+    def predict_seconds(self, voice, text, speed=1.0):
+        return len(text) / self.chars_per_second(voice) / speed
+
+    def update(self, voice, text, audio_seconds, speed):
+        if audio_seconds <= 0 or not text:
+            return
+        observed = len(text) / (audio_seconds * speed)
+        rate = self.chars_per_second(voice)
+        self.rates[voice] = rate + self.smoothing * (observed - rate)
+
+
+# The original strategy, a fixed speed that steps up once the backlog passes a threshold
+class ThresholdSpeedController:
+    def __init__(self, threshold_seconds=10.0, normal_speed=1.1, catch_up_speed=1.3, rate_model=None):
+        self.threshold_seconds = threshold_seconds
+        self.normal_speed = normal_speed
+        self.catch_up_speed = catch_up_speed
+        self.rate_model = rate_model or SpeakingRateModel()
+
+    def choose_speed(self, text, voice, backlog_seconds, inflight_seconds):
+        return self.catch_up_speed if backlog_seconds > self.threshold_seconds else self.normal_speed
+
+    def observe(self, text, voice, audio_seconds, speed):
+        self.rate_model.update(voice, text, audio_seconds, speed)
+
+
+# Aims for a target end-to-end latency. The audio still to be played ahead of a sentence is the measured
+# backlog plus the predicted length of sentences still being synthesized; once that plus the sentence itself
+# goes past the target, speed rises in proportion to the excess. Speeds are rounded to step so the audio
+# cache still gets hits for repeated sentences
+class LatencyTargetSpeedController:
+    def __init__(self, target_seconds=3.0, min_speed=1.1, max_speed=1.5, gain=0.05, step=0.05, rate_model=None):
+        self.target_seconds = target_seconds
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+        self.gain = gain  # speed increase per second over the target
+        self.step = step
+        self.rate_model = rate_model or SpeakingRateModel()
+
+    def choose_speed(self, text, voice, backlog_seconds, inflight_seconds):
+        sentence_seconds = self.rate_model.predict_seconds(voice, text, self.min_speed)
+        excess = backlog_seconds + inflight_seconds + sentence_seconds - self.target_seconds
+        speed = self.min_speed + self.gain * max(0.0, excess)
+        speed = round(speed / self.step) * self.step
+        return round(min(self.max_speed, max(self.min_speed, speed)), 2)
+
+    def observe(self, text, voice, audio_seconds, speed):
+        self.rate_model.update(voice, text, audio_seconds, speed)
+
+
+speed_controllers = {
+    "threshold": ThresholdSpeedController,
+    "latency": LatencyTargetSpeedController
+}
+
+# Build a controller by name, keyword arguments go to its constructor
+def create_speed_controller(name, **kwargs):
+    if name not in speed_controllers:
+        raise ValueError(f"Unknown speed controller {name}, expected one of {', '.join(speed_controllers)}")
+    return speed_controllers[name](**kwargs)
@@ -0,0 +1,209 @@
+import atexit, os, queue
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+
+from speaker_conditioning import SpeakerConditioningCache, clone_voice
+from g2p_cache import prepare_kokoro_pipeline
+from kokoro_quantization import kokoro_variant, quantize_kokoro
+
+# Multi-process synthesis backend. Each worker process loads the model once with a pinned number of torch
+# threads, so sentences synthesized at the same time don't share one GIL or fight over intra-op threads.
+# Audio comes back through a shared memory buffer owned by the parent, only small control messages go
+# through the pipe. The worker writes a chunk, says how long it is and waits for the parent to copy it out
+# ("next") or to stop ("cancel"), so one buffer per worker is enough
+
+warmup_text = "Warm up model. This is a warm up setence to initialize the model and weights. It should help reduce the latency for the first request later."
+
+# Convert a float waveform from either model to int16 samples, int16 audio is returned as it is
+def to_int16(audio):
+    if hasattr(audio, "detach"):
+        audio = audio.detach().cpu().numpy()
+    if isinstance(audio, np.ndarray) and audio.dtype == np.int16:
+        return audio
+    return (np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+
+# Load a model inside a worker process, returns (model type, model)
+def load_model(model_name, device, voices):
+    if model_name == "fake":
+        from fake_tts import FakePipeline
+        return "kokoro", FakePipeline()
+    if "kokoro" in model_name.lower():
+        from kokoro import KPipeline
+        pipeline = KPipeline(lang_code='a')
+        if variant := kokoro_variant(model_name):
+            quantize_kokoro(pipeline, variant)
+        prepare_kokoro_pipeline(pipeline, voices, int(os.environ.get("G2P_CACHE_SENTENCES", "4096")), int(os.environ.get("G2P_CACHE_WORDS", "16384")))
+        next(pipeline(warmup_text, voice='af_heart', speed=1))
+        return "kokoro", pipeline
+    import torch
+    from TTS.api import TTS
+    return "coqui", TTS(model_name).to(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+
+# Generator of the float audio chunks a loaded model produces for some text
+def generate(model, text, voice, speed, speaker_wav, speaker_cache):
+    model_type, instance = model
+    if model_type == "coqui":
+        yield from clone_voice(instance, text, speaker_wav, speaker_cache)
+    else:
+        for _, _, audio in instance(text, voice=voice, speed=speed):
+            yield audio
+
+# Entry point of a worker process, serves load and synthesize requests from the parent until it closes the pipe
+def worker_main(connection, shm_name, torch_threads):
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+    shm = SharedMemory(name=shm_name)
+    buffer = np.ndarray((shm.size // 2,), dtype=np.int16, buffer=shm.buf)
+    model = None
+    # Shares its on-disk store with the server and the other workers
+    speaker_cache = SpeakerConditioningCache(os.environ.get("SPEAKER_CACHE_DIR", "./speaker_cache"))
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            command = message[0]
+            if command == "close":
+                break
+            try:
+                if command == "load":
+                    model = load_model(*message[1:])
+                    connection.send(("loaded", None))
+                elif command == "synthesize":
+                    if model is None:
+                        raise RuntimeError("No model loaded.")
+                    _, text, voice, speed, speaker_wav = message
+                    stream_audio(connection, buffer, generate(model, text, voice, speed, speaker_wav, speaker_cache))
+                    connection.send(("done", None))
+            except Exception as e:
+                connection.send(("error", str(e)))
+    finally:
+        del buffer
+        shm.close()
+
+# Hand each chunk to the parent through the shared buffer, in pieces when a chunk is larger than it.
+# Returns early when the parent cancels
+def stream_audio(connection, buffer, audio_chunks):
+    for audio in audio_chunks:
+        wav = to_int16(audio)
+        for offset in range(0, len(wav), len(buffer)):
+            piece = wav[offset:offset + len(buffer)]
+            buffer[:len(piece)] = piece
+            connection.send(("chunk", len(piece)))
+            if connection.recv()[0] == "cancel":
+                return
+
+# One worker process, its end of the pipe and the shared buffer it writes audio into
+class SynthesisProcess:
+    def __init__(self, context, buffer_samples, torch_threads):
+        self.shm = SharedMemory(create=True, size=buffer_samples * 2)
+        self.buffer = np.ndarray((buffer_samples,), dtype=np.int16, buffer=self.shm.buf)
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_connection, self.shm.name, torch_threads), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def close(self):
+        try:
+            self.connection.send(("close",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        del self.buffer
+        self.shm.close()
+        self.shm.unlink()
+
+# Pool of worker processes. synthesize() checks out an idle process for the length of a sentence, so with
+# as many synthesis threads as processes each thread always finds one free. Processes are started by the
+# first load, not on import, because spawned children import the main module again
+class SynthesisProcessPool:
+    def __init__(self, worker_count, torch_threads, buffer_samples=24000 * 30):
+        self.worker_count = worker_count
+        self.torch_threads = torch_threads
+        self.buffer_samples = buffer_samples
+        # Spawn, not fork, so children don't inherit the parent's torch threads and locks
+        self.context = mp.get_context("spawn")
+        self.workers = []
+        self.idle = queue.Queue()
+        self.model = None  # (model name, device, voices) every worker has loaded
+        atexit.register(self.close)
+
+    def _start_worker(self):
+        worker = SynthesisProcess(self.context, self.buffer_samples, self.torch_threads)
+        self.workers.append(worker)
+        return worker
+
+    # Load a model in every worker process, waits for sentences being synthesized to finish first.
+    # Raises RuntimeError if any worker fails to load it
+    def load(self, model_name, device, voices=()):
+        if not self.workers:
+            for _ in range(self.worker_count):
+                self.idle.put(self._start_worker())
+        workers = [self.idle.get() for _ in range(self.worker_count)]
+        errors = []
+        try:
+            for worker in workers:
+                worker.connection.send(("load", model_name, device, voices))
+            # Workers load in parallel, collect every reply before reporting an error
+            for i, worker in enumerate(workers):
+                try:
+                    kind, value = worker.connection.recv()
+                except (EOFError, OSError):
+                    workers[i] = self._replace(worker, load=False)
+                    kind, value = "error", "Synthesis process exited while loading the model."
+                if kind == "error":
+                    errors.append(value)
+        finally:
+            for worker in workers:
+                self.idle.put(worker)
+        if errors:
+            raise RuntimeError(errors[0])
+        self.model = (model_name, device, voices)
+
+    # Generator of the int16 chunks of one sentence. Closing it early cancels the rest of the sentence
+    def synthesize(self, text, voice, speed, speaker_wav=None):
+        worker = self.idle.get()
+        awaiting_ack = False
+        try:
+            worker.connection.send(("synthesize", text, voice, speed, speaker_wav))
+            while True:
+                kind, value = worker.connection.recv()
+                if kind == "error":
+                    raise RuntimeError(value)
+                if kind == "done":
+                    return
+                wav = worker.buffer[:value].copy()
+                awaiting_ack = True
+                yield wav
+                awaiting_ack = False
+                worker.connection.send(("next",))
+        except (EOFError, OSError):
+            # The process died mid sentence, replace it so the pool keeps its size
+            worker = self._replace(worker)
+            raise RuntimeError("Synthesis process exited.")
+        finally:
+            if awaiting_ack:
+                worker.connection.send(("cancel",))
+                while worker.connection.recv()[0] not in ("done", "error"):
+                    worker.connection.send(("cancel",))
+            self.idle.put(worker)
+
+    def _replace(self, worker, load=True):
+        self.workers.remove(worker)
+        worker.close()
+        worker = self._start_worker()
+        if load and self.model is not None:
+            worker.connection.send(("load", *self.model))
+            worker.connection.recv()
+        return worker
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
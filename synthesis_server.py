@@ -1,226 +1,1140 @@
-import torch, time, numpy as np, sounddevice as sd, atexit, json
-from TTS.api import TTS
-from flask import Flask, request, jsonify
+import time
+server_import_start = time.perf_counter()
+import numpy as np, atexit, json, os, heapq, re, math
+import multiprocessing as mp
+from contextlib import contextmanager
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Event
 import itertools
+from collections import deque
+from functools import partial
 
-from kokoro import KPipeline
+from audio_sinks import SoundDeviceSink, NullSink, WavFileSink, OpusStreamSink
+from audio_cache import AudioCache, normalize_text
+from speed_controller import create_speed_controller
+from segmenter import IncrementalSegmenter
+from metrics import Metrics
+from synthesis_processes import SynthesisProcessPool, to_int16
+from fake_tts import FakePipeline
+from model_registry import ModelRegistry
+from g2p_cache import prepare_kokoro_pipeline, kokoro_cache_stats
+from kokoro_quantization import kokoro_variant, quantize_kokoro
+from time_stretch import BacklogStretcher
+from latency_log import LatencyLog
+from tracing import Tracer
+from micro_batching import MicroBatcher, supports_batching
+from speaker_conditioning import SpeakerConditioningCache, clone_voice, supports_conditioning
+
+# State for one call. Everything that used to be a module global is kept per session so one
+# process (and one loaded model) can serve many concurrent calls
+class Session:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.synthesis_results = {} # dictionary to store the wav audio chunks produced by the TTS model
+        self.synthesis_lock = Lock()
+        self.synthesis_ready = Condition(self.synthesis_lock)  # notified whenever synthesis_results or skipped_ids change
+        self.synthesis_counter = itertools.count(start=1)
+        self.next_to_play = 1
+        self.text_buffer = {"start": None, "end": None, "connection start": None}  # timing of the text held by segmenter
+        self.segmenter = IncrementalSegmenter(segment_max_words, segment_max_seconds, segment_flush_seconds)
+        self.buffer_lock = Lock()
+        self.skipped_ids = set()
+        self.total_queued_audio_duration = 0  # in seconds
+        self.inflight_seconds = {}  # sequence id -> predicted audio seconds for sentences not yet fully synthesized
+        self.voice = "af_heart"  # Default voice
+        self.speaker_wav = default_speaker_wav  # reference voice for Coqui voice cloning
+        self.speculation = None  # speculative synthesis of the text currently in the buffer
+        self.sentence_timings = {}  # sequence id -> text and stage times for the latency log and tracing, until it has played
+        self.trace_fragments = []  # (received at, buffered at, text) of the fragments with text still in the buffer
+        # One output stays open for the whole session, fed from a preallocated ring buffer
+        self.audio_sink = create_audio_sink(session_id)
+        self.closed = False
+
+    # Audio backlog in seconds, synthesized audio waiting to be played plus what is already in the output buffer
+    def queued_audio_seconds(self):
+        with self.synthesis_lock:
+            return self.total_queued_audio_duration + self.audio_sink.buffered_seconds()
+
+    # Predicted audio still to come from sentences ahead of sid that are queued or being synthesized
+    def inflight_seconds_before(self, sid):
+        with self.synthesis_lock:
+            return sum(seconds for other_sid, seconds in self.inflight_seconds.items() if other_sid < sid)
+
+# Synthesis started on buffered text before its sentence is complete. It is adopted by the sentence
+# the segmenter produces if the text matches, otherwise it is cancelled and its audio thrown away
+class Speculation:
+    def __init__(self, text):
+        self.text = text
+        self.cancelled = Event()
+        self.sid = None  # set when adopted, chunks are then published under this sequence id
+        self.audio_start_time = None
+        self.audio_end_time = None
+        self.chunks = []  # audio produced before adoption
+        self.done = False
+        self.started_at = None  # ms, when a worker started synthesizing it
+        self.finished_at = None
+        self.speed = None
 
 # Define global variables used for synthesis and concurrency safety
-synthesis_results = {} # dictionary to store the wav audio produced by the TTS model
-synthesis_lock = Lock()
-synthesis_counter = itertools.count(start=1)
-next_to_play = 1
-text_buffer = {"text": "", "start": None, "end": None}
-pending_ids = []
-buffer_lock = Lock()
-skipped_ids = set()
-# Dictionary to store testing logs
+sessions = {}  # session id -> Session
+sessions_lock = Lock()
+default_session_id = "default"  # used when a request doesn't send a session id
+# Bounded synthesis executor shared by all sessions. Each session has a heap ordered by sequence id so the
+# sentence its playback is waiting on (next_to_play) is picked up first, and sessions are served earliest
+# deadline first by the deadline of that sentence
+synthesis_worker_count = int(os.environ.get("SYNTHESIS_WORKERS", "2"))
+# MICRO_BATCHING=1 runs the Kokoro sentences the workers are synthesizing at the same time through the model
+# as one batch. Chunks arriving within BATCH_WINDOW_MS are batched, up to BATCH_MAX_SIZE and as many as keep
+# a batch within BATCH_MAX_LATENCY_MS. Enough workers are started to fill a batch
+micro_batching = os.environ.get("MICRO_BATCHING", "0") == "1"
+batch_window_ms = float(os.environ.get("BATCH_WINDOW_MS", "5"))
+batch_max_size = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+batch_max_latency_ms = float(os.environ.get("BATCH_MAX_LATENCY_MS", "300"))
+synthesis_queues = {}  # session id -> heap of (sequence id, job number, queued at, deadline, job args)
+synthesis_job_counter = itertools.count()  # tie breaker for jobs with the same sequence id or deadline
+synthesis_queue_length = 0
+synthesis_queue_cond = Condition()
+# When streaming, each chunk the pipeline yields is handed to playback as soon as it is ready
+streaming_synthesis = os.environ.get("STREAMING_SYNTHESIS", "1") == "1"
+playback_buffer_seconds = float(os.environ.get("PLAYBACK_BUFFER_SECONDS", "2"))
+# PLAYBACK_STRETCH=1 catches up on playback too: while a session has more than STRETCH_TARGET_SECONDS of audio
+# waiting, each chunk is time-stretched on its way to the output, STRETCH_GAIN faster per second over the
+# target and at most STRETCH_MAX_FACTOR. This reacts to backlog that builds up after a sentence's speed was chosen
+playback_stretch = os.environ.get("PLAYBACK_STRETCH", "0") == "1"
+backlog_stretcher = BacklogStretcher(
+    float(os.environ.get("STRETCH_TARGET_SECONDS", "3")),
+    float(os.environ.get("STRETCH_GAIN", "0.05")),
+    float(os.environ.get("STRETCH_MAX_FACTOR", "1.5"))
+) if playback_stretch else None
+# Where each session's audio goes: "sounddevice" plays it locally, "opus" streams it from /audio/<session id>,
+# "wav" records it to WAV_SINK_DIR and "null" discards it. SINK_REALTIME=0 lets the non-device sinks
+# take audio as fast as it is synthesized instead of at playback speed
+audio_sink_type = os.environ.get("AUDIO_SINK", "sounddevice")
+wav_sink_dir = os.environ.get("WAV_SINK_DIR", "./recordings")
+sink_realtime = os.environ.get("SINK_REALTIME", "1") == "1"
+# Cache of finished waveforms so repeated sentences skip the model, 0 MB disables it
+audio_cache_mb = float(os.environ.get("AUDIO_CACHE_MB", "64"))
+audio_cache = AudioCache(int(audio_cache_mb * 1024 * 1024), os.environ.get("AUDIO_CACHE_DIR", "./audio_cache")) if audio_cache_mb > 0 else None
+# Segmenting, long fragments are split at clause boundaries past SEGMENT_MAX_WORDS words or SEGMENT_MAX_SECONDS
+# in the buffer, and a buffer with no new text for SEGMENT_FLUSH_SECONDS is synthesized as it is
+segment_max_words = int(os.environ.get("SEGMENT_MAX_WORDS", "12"))
+segment_max_seconds = float(os.environ.get("SEGMENT_MAX_SECONDS", "2"))
+segment_flush_seconds = float(os.environ.get("SEGMENT_FLUSH_SECONDS", "1.5"))
+segment_flush_cond = Condition()  # notified when new text arrives so the flush worker recomputes its deadline
+# Opt-in speculative synthesis of buffered text that has had no new text for SPECULATION_DELAY_SECONDS
+speculative_synthesis = os.environ.get("SPECULATIVE_SYNTHESIS", "0") == "1"
+speculation_delay_seconds = float(os.environ.get("SPECULATION_DELAY_SECONDS", "0.3"))
+speculation_min_words = int(os.environ.get("SPECULATION_MIN_WORDS", "3"))
+# Kokoro voices sessions can choose, their voice packs are loaded with the model
+allowed_voices = ("af_heart", "af_bella", "am_fenrir", "am_michael")
+# Phonemes cached in front of Kokoro's G2P, by segment and by word for words missing from its lexicon
+g2p_cache_sentences = int(os.environ.get("G2P_CACHE_SENTENCES", "4096"))
+g2p_cache_words = int(os.environ.get("G2P_CACHE_WORDS", "16384"))
+# Coqui voice cloning. Sessions can pick any reference wav in SPEAKER_WAV_DIR, the speaker conditioning
+# computed from each one is cached in memory and in SPEAKER_CACHE_DIR
+speaker_wav_dir = os.environ.get("SPEAKER_WAV_DIR", "./audio")
+default_speaker_wav = os.path.join(speaker_wav_dir, "johns_voice.wav")
+speaker_conditioning = SpeakerConditioningCache(os.environ.get("SPEAKER_CACHE_DIR", "./speaker_cache"))
+# Speed controller for Kokoro, "latency" aims for TARGET_LATENCY_SECONDS end to end, "threshold" is the original 1.1/1.3 step
+speed_controller_name = os.environ.get("SPEED_CONTROLLER", "latency")
+speed_controller_options = {"latency": {"target_seconds": float(os.environ.get("TARGET_LATENCY_SECONDS", "3"))}}
+speed_controller = create_speed_controller(speed_controller_name, **speed_controller_options.get(speed_controller_name, {}))
+# Admission control, /synthesis answers 429 with a Retry-After header while the session has more than
+# MAX_BACKLOG_SECONDS of audio waiting to be played or synthesized, or MAX_QUEUED_SENTENCES sentences are
+# queued across all sessions. 0 turns a limit off
+max_backlog_seconds = float(os.environ.get("MAX_BACKLOG_SECONDS", "30"))
+max_queued_sentences = int(os.environ.get("MAX_QUEUED_SENTENCES", "64"))
+# Every sentence should start playing within LATENCY_BUDGET_SECONDS of the end of its speech. A sentence that
+# can't make that deadline any more when a worker picks it up is handled by DEADLINE_POLICY: "none"
+# synthesizes it as usual, "skip" drops it, "merge" synthesizes it together with the session's next queued
+# sentences (DEADLINE_MERGE_MAX at most) and "speedup" synthesizes it DEADLINE_SPEEDUP times faster, up to
+# DEADLINE_MAX_SPEED. Each decision is counted in the metrics
+latency_budget_seconds = float(os.environ.get("LATENCY_BUDGET_SECONDS", "5"))
+deadline_policy = os.environ.get("DEADLINE_POLICY", "none")
+deadline_policies = ("none", "skip", "merge", "speedup")
+if deadline_policy not in deadline_policies:
+    raise ValueError(f"Unknown deadline policy {deadline_policy}, expected one of {', '.join(deadline_policies)}")
+deadline_merge_max = int(os.environ.get("DEADLINE_MERGE_MAX", "3"))
+deadline_speedup = float(os.environ.get("DEADLINE_SPEEDUP", "1.25"))
+deadline_max_speed = float(os.environ.get("DEADLINE_MAX_SPEED", "2.0"))
+# Live metrics with fixed memory histograms, served from /metrics
+metrics = Metrics()
+# Dictionary to store testing logs, in the layout the tests/ scripts read. Only the most recent
+# TESTING_LOG_LIMIT entries of each are kept, the full distributions are in metrics
+testing_log_limit = int(os.environ.get("TESTING_LOG_LIMIT", "10000"))
+# Every measurement and every played sentence's stage times are appended to a binary log in a new directory
+# under LATENCY_LOG_DIR for each run, flushed every LATENCY_LOG_FLUSH_SECONDS, so a crash loses at most
+# that much. tests/convert_latency_log.py turns a run into testing_logs.json. Empty turns it off, then the
+# testing logs are saved as JSON at exit instead
+latency_log_dir = os.environ.get("LATENCY_LOG_DIR", "./latency_logs")
+latency_log_flush_seconds = float(os.environ.get("LATENCY_LOG_FLUSH_SECONDS", "1"))
+# Synthesis processes import this module again, only the server itself writes a log
+latency_log = LatencyLog(
+    os.path.join(latency_log_dir, time.strftime("run-%Y%m%d-%H%M%S") + f"-{os.getpid()}"), latency_log_flush_seconds
+) if latency_log_dir and mp.parent_process() is None else None
+# Traces of TRACE_SAMPLE_RATE of the sentences through every stage of the pipeline, the last TRACE_BUFFER
+# served from /traces in the Chrome trace event format. 0 turns tracing off, 1 traces every sentence
+trace_sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+tracer = Tracer(trace_sample_rate, int(os.environ.get("TRACE_BUFFER", "1000"))) if trace_sample_rate > 0 else None
+# Each sentence's stage times are kept while the latency log or tracing needs them
+track_sentences = latency_log is not None or tracer is not None
 testing_logs = {
     "transcription time": {},
     "synthesis time": {},
-    "transmission time": [],
-    "sampling time": [],
-    "playback time": [],
-    "system latency": []
+    "transmission time": deque(maxlen=testing_log_limit),
+    "sampling time": deque(maxlen=testing_log_limit),
+    "playback time": deque(maxlen=testing_log_limit),
+    "system latency": deque(maxlen=testing_log_limit),
+    "queue depth": deque(maxlen=testing_log_limit),
+    "queue wait time": deque(maxlen=testing_log_limit),
+    "time to first audio": deque(maxlen=testing_log_limit),
+    "speculation saved time": deque(maxlen=testing_log_limit),
+    "speculation wasted time": deque(maxlen=testing_log_limit),
+    "deadline slack": deque(maxlen=testing_log_limit)
 }
 
 # Initialize Flask app and enables CORS
 app = Flask(__name__)
 CORS(app)
 
-# Global variables for TTS model and pipeline
-tts_model = None
-kokoro_pipeline = None
-model_type = None  # 'coqui' or 'kokoro'
-total_queued_audio_duration = 0  # in seconds
-voice = "af_heart"  # Default voice
+model_loading = False
+model_error = None  # why the last load failed
+model_load_lock = Lock()  # one model load at a time
+# Model to load and warm in the background at startup, so the server becomes ready without a /load_model call
+preload_model_name = os.environ.get("PRELOAD_MODEL")
+# How long each phase of starting the server and loading the model took in ms, served from /readyz
+startup_phases = {}
 
 sample_rate = 24000
-device = "cuda" if torch.cuda.is_available() else "cpu"
+device = None  # set when torch is first imported
 
-# Allows users to load the model they want to use
-@app.route("/load_model", methods=["POST"])
-def load_model():
-    global tts_model, kokoro_pipeline, model_type
-    model_name = request.json.get("model", "kokoro")
+# Split the CPU cores between the synthesis workers so they don't oversubscribe torch's intra-op threads.
+# Micro-batches run one at a time, so they get every core
+torch_threads = int(os.environ.get("TORCH_THREADS", max(1, (os.cpu_count() or 1) // (1 if micro_batching else synthesis_worker_count))))
+# SYNTHESIS_BACKEND=process runs the model in one process per synthesis worker instead of in the workers'
+# threads, each process gets TORCH_THREADS threads and loads the model itself
+synthesis_backend = os.environ.get("SYNTHESIS_BACKEND", "thread")
+synthesis_pool = SynthesisProcessPool(synthesis_worker_count, torch_threads) if synthesis_backend == "process" else None
+# Loaded models shared by every session. Models that aren't active stay resident within MODEL_MEMORY_MB so
+# switching back to one is instant. The process backend's workers hold one model, so nothing else is kept
+model_memory_mb = float(os.environ.get("MODEL_MEMORY_MB", "4096"))
+model_registry = ModelRegistry(int(model_memory_mb * 1024 * 1024), max_models=1 if synthesis_pool is not None else None)
+micro_batcher = MicroBatcher(batch_window_ms, batch_max_size, batch_max_latency_ms) if micro_batching and synthesis_pool is None else None
+
+# Each route's work is done by a handle_ function taking the request JSON and returning (body, status, headers),
+# shared by the Flask routes here and the asyncio server in async_server.py
 
+# Time a phase of startup or model loading into startup_phases
+@contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = (time.perf_counter() - start) * 1000
+
+# torch and the model libraries are imported when a model is loaded, not when the server starts, so only
+# the backend that is used gets imported. The fake backend and the process backend's parent never need them
+def import_torch():
+    global device
+    if device is None:
+        with startup_phase("torch import"):
+            import torch
+            torch.set_num_threads(torch_threads)
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Allows users to load the model they want to use. With "background": true the load runs in a thread
+# and the request returns straight away, /readyz reports when the model is ready
+def handle_load_model(data):
+    model_name = data.get("model", "kokoro")
+    # Reference wavs to compute voice cloning conditioning for as part of the load, as well as the default one
+    speaker_wavs = data.get("speaker wav", [])
+    speaker_wavs = [speaker_wavs] if isinstance(speaker_wavs, str) else speaker_wavs
+    for speaker_wav in speaker_wavs:
+        if resolve_speaker_wav(speaker_wav) is None:
+            return {"status": "error", "message": f"Unknown speaker wav {speaker_wav}."}, 400, {}
+    speaker_wavs = [default_speaker_wav] + [resolve_speaker_wav(speaker_wav) for speaker_wav in speaker_wavs]
+    if data.get("background"):
+        Thread(target=load_model_now, args=(model_name, speaker_wavs), daemon=True).start()
+        return {"status": "success", "message": f"Loading {model_name} in the background."}, 202, {}
+    return load_model_now(model_name, speaker_wavs)
+
+# Load a model, one load at a time, keeping the readiness state and phase timings up to date
+def load_model_now(model_name, speaker_wavs=()):
+    global model_loading, model_error
+    with model_load_lock:
+        model_loading = True
+        # Phases of the previous load don't apply to this model
+        for phase in ("model import", "model build", "quantization", "voice packs", "model warmup", "speaker conditioning"):
+            startup_phases.pop(phase, None)
+        try:
+            with startup_phase("model load"):
+                body, status, headers = load_backend(model_name)
+            if status == 200:
+                with startup_phase("speaker conditioning"):
+                    preload_speaker_conditioning(speaker_wavs)
+        except Exception as e:
+            body, status, headers = {"status": "error", "message": str(e)}, 500, {}
+        finally:
+            model_loading = False
+        model_error = body["message"] if status != 200 else None
+        if status == 200 and "time to ready" not in startup_phases:
+            startup_phases["time to ready"] = (time.perf_counter() - server_import_start) * 1000
+        print(f"Load {model_name}: {body['message']} | " + " | ".join(f"{phase} {ms:.0f} ms" for phase, ms in startup_phases.items()))
+        return body, status, headers
+
+# Make model_name the active model, loading and warming it next to the current one if it isn't resident
+def load_backend(model_name):
+    if synthesis_pool is not None:
+        loader = partial(load_into_processes, model_name)
+    elif "kokoro" in model_name.lower():
+        loader = partial(load_kokoro, model_name)
+    elif model_name == "fake":
+        loader = load_fake
+    else:
+        loader = partial(load_coqui, model_name)
+    if not model_registry.activate(model_name, loader):
+        return {"status": "success", "message": f"Model {model_name} already loaded."}, 200, {}
+    if synthesis_pool is not None:
+        return {"status": "success", "message": f"Model {model_name} loaded in {synthesis_worker_count} synthesis processes."}, 200, {}
     if "kokoro" in model_name.lower():
-        kokoro_pipeline = KPipeline(lang_code='a')
-        tts_model = None
-        model_type = "kokoro"
-        # Warm the model to avoid latency on first request
+        variant = kokoro_variant(model_name)
+        return {"status": "success", "message": f"Kokoro {variant + ' ' if variant else ''}model loaded and warmed up."}, 200, {}
+    if model_name == "fake":
+        return {"status": "success", "message": "Fake model loaded."}, 200, {}
+    return {"status": "success", "message": f"Model {model_name} loaded."}, 200, {}
+
+# Path of a reference wav in speaker_wav_dir, None if it isn't a file in there
+def resolve_speaker_wav(name):
+    directory = os.path.realpath(speaker_wav_dir)
+    path = os.path.realpath(os.path.join(directory, name))
+    if os.path.dirname(path) != directory or not os.path.isfile(path):
+        return None
+    return path
+
+# Compute the voice cloning conditioning of reference wavs ahead of the first sentence that uses them.
+# Only for XTTS in this process, synthesis processes compute it on first use
+def preload_speaker_conditioning(speaker_wavs):
+    loaded_model = model_registry.acquire()
+    if loaded_model is None:
+        return
+    try:
+        if loaded_model.model_type == "coqui" and supports_conditioning(loaded_model.model):
+            for speaker_wav in speaker_wavs:
+                if os.path.isfile(speaker_wav):
+                    speaker_conditioning.get(loaded_model.model, speaker_wav)
+    finally:
+        model_registry.release(loaded_model)
+
+# Loaders for the model registry, each returns (model type, model)
+def load_into_processes(model_name):
+    synthesis_pool.load(model_name, device, allowed_voices)
+    return "kokoro" if "kokoro" in model_name.lower() or model_name == "fake" else "coqui", None
+
+def load_kokoro(model_name="kokoro"):
+    import_torch()
+    with startup_phase("model import"):
+        from kokoro import KPipeline
+    with startup_phase("model build"):
+        pipeline = KPipeline(lang_code='a')
+    if variant := kokoro_variant(model_name):
+        with startup_phase("quantization"):
+            quantize_kokoro(pipeline, variant)
+    with startup_phase("voice packs"):
+        prepare_kokoro_pipeline(pipeline, allowed_voices, g2p_cache_sentences, g2p_cache_words)
+    # Warm the model to avoid latency on first request
+    with startup_phase("model warmup"):
         warmup_text = "Warm up model. This is a warm up setence to initialize the model and weights. It should help reduce the latency for the first request later."
-        generator = kokoro_pipeline(warmup_text, voice='af_heart', speed=1)
+        generator = pipeline(warmup_text, voice='af_heart', speed=1)
         _, _, _ = next(generator)
-        return jsonify({"status": "success", "message": "Kokoro model loaded and warmed up."})
+    return "kokoro", pipeline
+
+# Deterministic stand-in that behaves like Kokoro, for load tests
+def load_fake():
+    return "kokoro", FakePipeline()
+
+def load_coqui(model_name):
+    import_torch()
+    with startup_phase("model import"):
+        from TTS.api import TTS
+    with startup_phase("model build"):
+        return "coqui", TTS(model_name).to(device)
+
+@app.route("/load_model", methods=["POST"])
+def load_model():
+    body, status, headers = handle_load_model(request.json)
+    return jsonify(body), status, headers
+
+# Record a measurement in the live metrics and the testing logs. Logs keyed by sentence text keep the
+# latest value for a repeated sentence, the metrics count every one. A tuple value is logged whole and
+# its first element observed
+def record_metric(name, value, key=None, unit="ms"):
+    metrics.observe(name, value[0] if isinstance(value, tuple) else value, unit)
+    if latency_log is not None:
+        latency_log.measurement(name, value, key)
+    log = testing_logs.get(name)
+    if log is None:
+        return
+    if key is None:
+        log.append(value)
     else:
-        if tts_model is not None and model_name == getattr(tts_model, 'model_name', None):
-            return jsonify({"status": "success", "message": f"Model {model_name} already loaded."})
-        try:
-            tts_model = TTS(model_name).to(device)
-            kokoro_pipeline = None
-            model_type = "coqui"
-            return jsonify({"status": "success", "message": f"Model {model_name} loaded."})
-        except Exception as e:
-            return jsonify({"status": "error", "message": str(e)}), 500
+        log[key] = value
+        if len(log) > testing_log_limit:
+            log.pop(next(iter(log)))
+
+# Create the configured audio sink for a new session
+def create_audio_sink(session_id):
+    if audio_sink_type == "opus":
+        return OpusStreamSink(sample_rate, buffer_seconds=playback_buffer_seconds, realtime=sink_realtime)
+    if audio_sink_type == "wav":
+        os.makedirs(wav_sink_dir, exist_ok=True)
+        return WavFileSink(sample_rate, os.path.join(wav_sink_dir, f"{session_id}.wav"), buffer_seconds=playback_buffer_seconds, realtime=sink_realtime)
+    if audio_sink_type == "null":
+        return NullSink(sample_rate, buffer_seconds=playback_buffer_seconds, realtime=sink_realtime)
+    return SoundDeviceSink(sample_rate, buffer_seconds=playback_buffer_seconds)
+
+# Look up the session for a session id, creating it and starting its playback worker on first use
+def get_session(session_id):
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = Session(session_id)
+            sessions[session_id] = session
+            Thread(target=playback_worker, args=(session,), daemon=True).start()
+        return session
+
+# A session that already exists, None otherwise. For lookups that mustn't start a session and its playback
+def find_session(session_id):
+    with sessions_lock:
+        return sessions.get(session_id)
+
+# Audio callback marker for the first sample of a sentence reaching the output
+def mark_playback_start(synthesis_result, playback_start_time):
+    synthesis_result["playback_start_time"] = playback_start_time
 
-# Worker to read synthesizied audio and play it in order
-def playback_worker():
-    global next_to_play, total_queued_audio_duration
+# Audio callback marker for the last sample of a sentence reaching the output, records its latency
+def record_playback(synthesis_result, playback_end_time):
+    playback_start_time = synthesis_result["playback_start_time"]
+    average_delay = ((playback_start_time - synthesis_result["audio_start_time"]) + (playback_end_time - synthesis_result["audio_end_time"])) / 2
+    record_metric("playback time", playback_end_time - playback_start_time)
+    record_metric("system latency", average_delay)
+
+# Add stage times to a sentence's timings. A speculation's sentence is the one that adopted it,
+# nothing is noted before then
+def note_sentence(session, sid, speculation, stages):
+    if not track_sentences:
+        return
+    if speculation is not None:
+        sid = speculation.sid
+    with session.synthesis_lock:
+        timings = session.sentence_timings.get(sid)
+        if timings is not None:
+            timings.update(stages)
+
+# Audio callback marker, or called straight away for a sentence that never played, that writes a
+# sentence's stage times to the latency log and its trace if it was sampled
+def finish_sentence(session, sid, synthesis_result, playback_end_time=None):
+    with session.synthesis_lock:
+        timings = session.sentence_timings.pop(sid, None)
+    if timings is None:
+        return
+    if playback_end_time is not None:
+        timings["playback start"] = synthesis_result["playback_start_time"]
+        timings["playback end"] = playback_end_time
+    text = timings.pop("text")
+    fragments = timings.pop("fragments", None)
+    if latency_log is not None:
+        latency_log.sentence(session.session_id, sid, text, timings)
+    if fragments is not None:
+        tracer.record(session.session_id, sid, text, timings, fragments)
+
+# Worker to read a session's synthesizied audio and feed it to its output stream in order.
+# Sleeps on synthesis_ready until the next sequence id has audio, rather than polling
+def playback_worker(session):
     while True:
-        with synthesis_lock:
-            while next_to_play in skipped_ids:
-                skipped_ids.remove(next_to_play)
-                next_to_play += 1
-
-            if next_to_play in synthesis_results:
-                synthesis_result = synthesis_results.pop(next_to_play)
-                wav = synthesis_result["wav"]
-                audio_start_time = synthesis_result["audio_start_time"]
-                audio_end_time = synthesis_result["audio_end_time"]
-                duration_sec = len(wav) / sample_rate
-                total_queued_audio_duration = max(0, total_queued_audio_duration - duration_sec)
-                next_to_play += 1
+        with session.synthesis_ready:
+            while True:
+                if session.closed:
+                    break
+                while session.next_to_play in session.skipped_ids:
+                    session.skipped_ids.remove(session.next_to_play)
+                    session.next_to_play += 1
+                synthesis_result = session.synthesis_results.get(session.next_to_play)
+                if synthesis_result is not None and (synthesis_result["chunks"] or synthesis_result["done"]):
+                    break
+                session.synthesis_ready.wait()
+
+            if session.closed:
+                synthesis_result = None
+            elif synthesis_result["chunks"]:
+                wav = synthesis_result["chunks"].popleft()
+                session.total_queued_audio_duration = max(0, session.total_queued_audio_duration - len(wav) / sample_rate)
+                first_chunk = not synthesis_result.get("playing")
+                synthesis_result["playing"] = True
             else:
+                # Sentence fully written to the output, move on to the next one
+                finished_sid = session.next_to_play
+                session.synthesis_results.pop(finished_sid)
+                session.next_to_play += 1
                 wav = None
 
-        if wav is not None:
-            try:
-                playback_start_time = time.time() * 1000
-                sd.play(wav, samplerate=sample_rate)
-                sd.wait()
-                playback_end_time = time.time() * 1000
-
-                average_delay = ((playback_start_time - audio_start_time) + (playback_end_time - audio_end_time)) / 2
-                testing_logs["playback time"].append(playback_end_time - playback_start_time)
-                testing_logs["system latency"].append(average_delay)
-            except Exception as e:
-                print("Playback error:", e)
+        if synthesis_result is None:
+            # Closed outside synthesis_lock: stopping a sink waits for its callback, whose markers take that lock
+            session.audio_sink.close()
+            return
+        try:
+            if wav is None:
+                if synthesis_result.get("playing"):
+                    session.audio_sink.mark(partial(record_playback, synthesis_result))
+                    if track_sentences:
+                        session.audio_sink.mark(partial(finish_sentence, session, finished_sid, synthesis_result))
+                elif track_sentences:
+                    finish_sentence(session, finished_sid, synthesis_result)
+                continue
+            if backlog_stretcher is not None:
+                # Backlog counting this chunk, which was taken out of it above
+                wav, factor = backlog_stretcher.stretch(wav, session.queued_audio_seconds() + len(wav) / sample_rate)
+                if factor != 1.0:
+                    record_metric("stretch factor", factor, unit="")
+                    metrics.increment("stretched chunks")
+            if first_chunk:
+                session.audio_sink.mark(partial(mark_playback_start, synthesis_result))
+            session.audio_sink.write(wav)
+        except Exception as e:
+            print("Playback error:", e)
+
+# Add a chunk of synthesized audio for a sequence id, done marks the sentence as complete
+def publish_chunk(session, sid, wav, audio_start_time, audio_end_time, done):
+    with session.synthesis_lock:
+        add_chunk(session, sid, wav, audio_start_time, audio_end_time, done)
+
+# publish_chunk for callers already holding the session's synthesis_lock
+def add_chunk(session, sid, wav, audio_start_time, audio_end_time, done):
+    synthesis_result = session.synthesis_results.setdefault(sid, {
+        "chunks": deque(),
+        "done": False,
+        "audio_start_time": audio_start_time,
+        "audio_end_time": audio_end_time
+    })
+    if wav is not None and len(wav) > 0:
+        synthesis_result["chunks"].append(wav)
+        session.total_queued_audio_duration += len(wav) / sample_rate
+    synthesis_result["done"] = done
+    if done:
+        session.inflight_seconds.pop(sid, None)
+    session.synthesis_ready.notify_all()
+
+# Add a chunk from speculative synthesis, held on the speculation until a sentence adopts it
+def publish_speculative_chunk(session, speculation, wav, done):
+    with session.synthesis_lock:
+        if speculation.cancelled.is_set():
+            # Cancelled after its last chunk was checked, all of its synthesis was wasted
+            if done:
+                record_metric("speculation wasted time", time.time() * 1000 - speculation.started_at)
+            return
+        if speculation.sid is None:
+            if wav is not None:
+                speculation.chunks.append(wav)
+            speculation.done = done
+            return
+        add_chunk(session, speculation.sid, wav, speculation.audio_start_time, speculation.audio_end_time, done)
+
+# Text compared when deciding if a sentence matches a speculation, ignoring case and punctuation
+def speculation_text(text):
+    return re.sub(r"[^\w\s']", "", normalize_text(text)).strip()
+
+# Start synthesizing the session's buffered text ahead of its sentence being complete. Call with buffer_lock held
+def start_speculation(session):
+    text = session.segmenter.text
+    if len(text.split()) < speculation_min_words:
+        return
+    session.speculation = Speculation(text)
+    submit_synthesis(session, text, 0, 0, None, 0, speculation=session.speculation)
+
+# Hand a speculation's audio to sequence id sid, returns False if it was already cancelled
+def adopt_speculation(session, speculation, sid, audio_start_time, audio_end_time):
+    with session.synthesis_lock:
+        if speculation.cancelled.is_set():
+            return False
+        speculation.sid = sid
+        speculation.audio_start_time = audio_start_time
+        speculation.audio_end_time = audio_end_time
+        # The sentence was never queued, its synthesis started before it was split from the buffer
+        timings = session.sentence_timings.get(sid)
+        if timings is not None:
+            stages = {"synthesis start": speculation.started_at}
+            if speculation.done:
+                stages.update({"synthesis end": speculation.finished_at, "speed": speculation.speed, "audio samples": sum(len(wav) for wav in speculation.chunks)})
+            timings.update({stage: value for stage, value in stages.items() if value is not None})
+        for wav in speculation.chunks:
+            add_chunk(session, sid, wav, audio_start_time, audio_end_time, done=False)
+        speculation.chunks = []
+        if speculation.done:
+            add_chunk(session, sid, None, audio_start_time, audio_end_time, done=True)
         else:
-            time.sleep(0.05)
-
-# Helper function to split text into sentences
-def split_sentence(text):
-    first_idx = -1
-    for punct in (".", "!", "?"):
-        idx = text.find(punct)
-        if idx != -1 and (first_idx == -1 or idx < first_idx):
-            first_idx = idx
-
-    if first_idx != -1:
-        return text[:first_idx+1], text[first_idx+1:].lstrip()
-    return None, text
-
-# Synthesis thread to create audio from text and add it to the queue
-def synthesize(text, audio_start_time, audio_end_time, sid, connection_start):
-    global total_queued_audio_duration
-    print(f"SID: {sid} | Start: {audio_start_time} | End: {audio_end_time} | Text: {text}")
+            session.inflight_seconds[sid] = speed_controller.rate_model.predict_seconds(session.voice, speculation.text)
+    # Time the sentence's synthesis was ahead of where it would have started without speculation
+    now = time.time() * 1000
+    started_at = speculation.started_at if speculation.started_at is not None else now
+    saved = (speculation.finished_at if speculation.finished_at is not None else now) - started_at
+    record_metric("speculation saved time", saved)
+    return True
+
+# Cancel a speculation that hasn't been adopted, the worker running it stops at its next chunk
+def cancel_speculation(session, speculation):
+    with session.synthesis_lock:
+        if speculation.sid is None:
+            speculation.cancelled.set()
+            speculation.chunks = []
+            if speculation.done:
+                record_metric("speculation wasted time", (speculation.finished_at or time.time() * 1000) - speculation.started_at)
+
+# Synthesis worker job to create audio from text and add it to the session's queue.
+# A speculative job has no sequence id yet, its audio goes to the speculation until it is adopted.
+# speed_boost multiplies the speed the controller chooses, for sentences that are behind their deadline
+def synthesize(session, text, audio_start_time, audio_end_time, sid, connection_start, speculation=None, speed_boost=1.0):
+    if speculation is not None:
+        if speculation.cancelled.is_set():
+            return
+        speculation.started_at = time.time() * 1000
+        publish = partial(publish_speculative_chunk, session, speculation)
+    else:
+        publish = lambda wav, done: publish_chunk(session, sid, wav, audio_start_time, audio_end_time, done)
+    print(f"Session: {session.session_id} | SID: {sid if speculation is None else 'speculative'} | Start: {audio_start_time} | End: {audio_end_time} | Text: {text}")
+    audio_start_time += connection_start
+    audio_end_time += connection_start
+    # The whole sentence uses the model and voice active when it starts, even if either is switched meanwhile
+    loaded_model = model_registry.acquire()
+    voice = session.voice
+    speaker_wav = session.speaker_wav
     try:
+        if loaded_model is None:
+            raise RuntimeError("No model loaded.")
+        model_type = loaded_model.model_type
+        start_time = time.time() * 1000
+        note_sentence(session, sid, speculation, {"synthesis start": start_time})
         if model_type == "coqui":
-            wav = tts_model.tts(text=text, speaker_wav="./audio/johns_voice.wav", language="en")
+            speed = 1.0
+            cache_key = AudioCache.key(loaded_model.name, speaker_wav, speed, text)
+        else:
+            # Choose speed from the audio backlog and the sentences still being synthesized ahead of this one
+            backlog_seconds = session.queued_audio_seconds()
+            speed = speed_controller.choose_speed(text, voice, backlog_seconds, session.inflight_seconds_before(sid if sid is not None else float("inf")))
+            if speed_boost != 1.0:
+                speed = round(min(deadline_max_speed, speed * speed_boost), 2)
+                metrics.increment("sped up sentences")
+            record_metric("backlog", backlog_seconds, unit="seconds")
+            record_metric("speed", speed, unit="")
+            cache_key = AudioCache.key(loaded_model.name, voice, speed, text)
+        if speculation is not None:
+            speculation.speed = speed
+
+        # Repeated sentences are served from the cache without touching the model
+        cached_wav = audio_cache.get(cache_key) if audio_cache is not None else None
+        if cached_wav is not None:
+            record_metric("time to first audio", time.time() * 1000 - start_time)
+            if speculation is not None:
+                speculation.finished_at = time.time() * 1000
+            note_sentence(session, sid, speculation, {"first audio": time.time() * 1000, "synthesis end": time.time() * 1000, "speed": speed, "audio samples": len(cached_wav)})
+            publish(cached_wav, done=True)
+            return
+
+        if synthesis_pool is not None:
+            audio_chunks = synthesis_pool.synthesize(text, voice, speed, speaker_wav if model_type == "coqui" else None)
+        elif model_type == "coqui":
+            audio_chunks = clone_voice(loaded_model.model, text, speaker_wav, speaker_conditioning)
+        elif micro_batcher is not None and supports_batching(loaded_model.model):
+            audio_chunks = micro_batcher.synthesize(loaded_model.model, text, voice, speed)
         else:
-            # Choose speed and voice based on queue length
-            with synthesis_lock:
-                queued_seconds = total_queued_audio_duration
-            speed = 1.3 if queued_seconds > 10 else 1.1
-
-            start_time = time.time() * 1000
-            generator = kokoro_pipeline(text, voice=voice, speed=speed)
-            _, _, audio = next(generator)
-            end_time = time.time() * 1000
-            testing_logs["synthesis time"][text] = (end_time - start_time, speed)
-
-            wav = (audio.detach().cpu().numpy() * 32767).astype(np.int16)
-            audio_duration_sec = len(wav) / sample_rate
-
-        with synthesis_lock:
-            total_queued_audio_duration += audio_duration_sec
-            synthesis_results[sid] = {
-                "wav": wav,
-                "audio_start_time": audio_start_time + connection_start,
-                "audio_end_time": audio_end_time + connection_start
-            }
+            audio_chunks = (audio for _, _, audio in loaded_model.model(text, voice=voice, speed=speed))
+
+        # Read the whole generator, long sentences are yielded as several segments
+        wavs = []
+        for audio in audio_chunks:
+            # Cancellation is cooperative, checked between the chunks the pipeline yields
+            if speculation is not None and speculation.cancelled.is_set():
+                record_metric("speculation wasted time", time.time() * 1000 - start_time)
+                return
+            wav = to_int16(audio)
+            if not wavs:
+                record_metric("time to first audio", time.time() * 1000 - start_time)
+                note_sentence(session, sid, speculation, {"first audio": time.time() * 1000})
+            wavs.append(wav)
+            if streaming_synthesis:
+                publish(wav, done=False)
+        end_time = time.time() * 1000
+        if speculation is not None:
+            speculation.finished_at = end_time
+        record_metric("synthesis time", (end_time - start_time, speed), key=text)
+
+        wav = np.concatenate(wavs) if wavs else None
+        note_sentence(session, sid, speculation, {"synthesis end": end_time, "speed": speed, "audio samples": len(wav) if wav is not None else 0})
+        if wav is not None and model_type != "coqui":
+            speed_controller.observe(text, voice, len(wav) / sample_rate, speed)
+        publish(None if streaming_synthesis else wav, done=True)
+        if audio_cache is not None and wav is not None:
+            audio_cache.put(cache_key, wav)
     except Exception as e:
         print(f"Synthesis error for seq {sid}:", e)
+        # Don't let a failed sentence block playback of the ones after it
+        publish(None, done=True)
+    finally:
+        if loaded_model is not None:
+            model_registry.release(loaded_model)
+
+# Queue a sentence for synthesis, records the queue depth it was added behind. Its deadline is
+# LATENCY_BUDGET_SECONDS after the end of its speech. Speculative jobs sort after every real sentence
+# of their session and have no deadline
+def submit_synthesis(session, text, audio_start_time, audio_end_time, sid, connection_start, speculation=None):
+    global synthesis_queue_length
+    if speculation is None:
+        with session.synthesis_lock:
+            session.inflight_seconds[sid] = speed_controller.rate_model.predict_seconds(session.voice, text)
+            timings = session.sentence_timings.get(sid)
+            if timings is not None:
+                timings["queued at"] = time.time() * 1000
+    with synthesis_queue_cond:
+        record_metric("queue depth", synthesis_queue_length, unit="")
+        queue = synthesis_queues.setdefault(session.session_id, [])
+        priority = sid if speculation is None else float("inf")
+        deadline = connection_start + audio_end_time + latency_budget_seconds * 1000 if speculation is None else float("inf")
+        heapq.heappush(queue, (priority, next(synthesis_job_counter), time.time() * 1000, deadline, (session, text, audio_start_time, audio_end_time, sid, connection_start, speculation)))
+        synthesis_queue_length += 1
+        synthesis_queue_cond.notify()
+
+# ms to spare before a sentence's deadline if it started playing once the audio its session has waiting and
+# the sentences being synthesized ahead of it have played, negative when it will be late
+def deadline_slack(session, sid, deadline):
+    waiting_seconds = session.queued_audio_seconds() + session.inflight_seconds_before(sid)
+    return deadline - (time.time() * 1000 + waiting_seconds * 1000)
+
+# Drop a sentence without synthesizing it, playback moves straight on to the next one
+def skip_sentence(session, sid):
+    with session.synthesis_lock:
+        session.skipped_ids.add(sid)
+        session.inflight_seconds.pop(sid, None)
+        session.sentence_timings.pop(sid, None)
+        session.synthesis_ready.notify_all()
+
+# Job args for a sentence together with the sentences that directly follow it in its session's queue,
+# synthesized as one under its sequence id. The sentences taken into it are skipped
+def merge_queued_sentences(args):
+    global synthesis_queue_length
+    session, text, audio_start_time, audio_end_time, sid, connection_start, speculation = args
+    merged = []
+    with synthesis_queue_cond:
+        queue = synthesis_queues.get(session.session_id)
+        while queue and len(merged) + 1 < deadline_merge_max and queue[0][4][0] is session and queue[0][0] == sid + len(merged) + 1:
+            merged.append(heapq.heappop(queue)[4])
+            synthesis_queue_length -= 1
+        if queue is not None and not queue:
+            del synthesis_queues[session.session_id]
+    if not merged:
+        return args
+    text = " ".join([text] + [other[1] for other in merged])
+    with session.synthesis_lock:
+        for other in merged:
+            session.skipped_ids.add(other[4])
+            session.inflight_seconds.pop(other[4], None)
+            session.sentence_timings.pop(other[4], None)
+        if sid in session.sentence_timings:
+            session.sentence_timings[sid].update({"text": text, "speech end": connection_start + merged[-1][3]})
+        session.inflight_seconds[sid] = speed_controller.rate_model.predict_seconds(session.voice, text)
+    metrics.increment("merged sentences", len(merged))
+    return session, text, audio_start_time, merged[-1][3], sid, connection_start, speculation
+
+# Worker that takes the queued sentence with the earliest deadline, the lowest sequence id of its session,
+# and synthesizes it. A sentence that will miss its deadline is handled by DEADLINE_POLICY
+def synthesis_worker():
+    global synthesis_queue_length
+    while True:
+        with synthesis_queue_cond:
+            while not synthesis_queues:
+                synthesis_queue_cond.wait()
+            session_id = min(synthesis_queues, key=lambda queued_id: (synthesis_queues[queued_id][0][3], synthesis_queues[queued_id][0][1]))
+            queue = synthesis_queues[session_id]
+            _, _, queued_at, deadline, args = heapq.heappop(queue)
+            synthesis_queue_length -= 1
+            if not queue:
+                del synthesis_queues[session_id]
+        if args[0].closed:
+            # Taken off the queue just before its session ended
+            continue
+        record_metric("queue wait time", time.time() * 1000 - queued_at)
+        speed_boost = 1.0
+        if deadline != float("inf"):
+            session, sid = args[0], args[4]
+            slack = deadline_slack(session, sid, deadline)
+            record_metric("deadline slack", slack)
+            if slack < 0:
+                metrics.increment("missed deadlines")
+                if deadline_policy == "skip":
+                    skip_sentence(session, sid)
+                    metrics.increment("skipped sentences")
+                    continue
+                if deadline_policy == "merge":
+                    args = merge_queued_sentences(args)
+                elif deadline_policy == "speedup":
+                    speed_boost = deadline_speedup
+        synthesize(*args, speed_boost=speed_boost)
+
+# Queue every segment the session's segmenter has ready, flush also takes whatever is left.
+# The end of each segment is estimated from its share of the buffered characters. Call with buffer_lock held
+def drain_segments(session, now, flush=False):
+    text_buffer = session.text_buffer
+    segmenter = session.segmenter
+    split = False
+    while segmenter.text:
+        total_chars = len(segmenter.text)
+        sentence = segmenter.next_segment(now)
+        if sentence is None and flush:
+            sentence = segmenter.flush()
+        if sentence is None:
+            break
+
+        duration_ms = text_buffer["end"] - text_buffer["start"]
+        estimated_sentence_end = text_buffer["start"] + int((len(sentence) / total_chars) * duration_ms)
+
+        sequence_id = next(session.synthesis_counter)
+        split = True
+        if track_sentences:
+            connection_start = text_buffer["connection start"]
+            timings = {"text": sentence, "speech start": text_buffer["start"] + connection_start, "speech end": estimated_sentence_end + connection_start, "split": time.time() * 1000}
+            if tracer is not None and tracer.sample():
+                timings["fragments"] = list(session.trace_fragments)
+            with session.synthesis_lock:
+                session.sentence_timings[sequence_id] = timings
+        # Only the first segment can match a speculation, it was started on the start of the buffer
+        speculation = session.speculation
+        session.speculation = None
+        adopted = False
+        if speculation is not None:
+            if speculation_text(speculation.text) == speculation_text(sentence):
+                connection_start = text_buffer["connection start"]
+                adopted = adopt_speculation(session, speculation, sequence_id, text_buffer["start"] + connection_start, estimated_sentence_end + connection_start)
+            if not adopted:
+                cancel_speculation(session, speculation)
+        if not adopted:
+            submit_synthesis(session, sentence, text_buffer["start"], estimated_sentence_end, sequence_id, text_buffer["connection start"])
+        text_buffer["start"] = estimated_sentence_end if segmenter.text else None
+    # What is left in the buffer came from the last fragment
+    if split and tracer is not None:
+        session.trace_fragments = session.trace_fragments[-1:] if segmenter.text else []
+
+# Worker that synthesizes buffered text that has stalled, so a fragment without punctuation
+# doesn't wait for the next transcript to arrive. Also starts speculative synthesis when enabled
+def segment_flush_worker():
+    while True:
+        # Held while scanning so a notify from /synthesis can't slip in before the wait
+        with segment_flush_cond:
+            with sessions_lock:
+                active_sessions = list(sessions.values())
+            now = time.time()
+            deadlines = []
+            for session in active_sessions:
+                with session.buffer_lock:
+                    deadline = session.segmenter.flush_deadline()
+                    if deadline is not None and deadline <= now:
+                        drain_segments(session, now, flush=True)
+                        deadline = session.segmenter.flush_deadline()
+                    if deadline is not None:
+                        deadlines.append(deadline)
+                    if speculative_synthesis and session.speculation is None and session.segmenter.text:
+                        speculate_at = session.segmenter.last_update + speculation_delay_seconds
+                        if speculate_at <= now:
+                            start_speculation(session)
+                        else:
+                            deadlines.append(speculate_at)
+            segment_flush_cond.wait(max(0, min(deadlines) - time.time()) if deadlines else None)
+
+# Seconds a client should wait before sending more text, or None when the server can take it. The session's
+# backlog drains at playback speed and the queue at the mean synthesis time per worker
+def admission_retry_after(session):
+    retry_after = 0.0
+    if max_backlog_seconds > 0:
+        backlog = session.queued_audio_seconds() + session.inflight_seconds_before(float("inf"))
+        if backlog > max_backlog_seconds:
+            retry_after = backlog - max_backlog_seconds
+    if max_queued_sentences > 0 and synthesis_queue_length >= max_queued_sentences:
+        excess = synthesis_queue_length - max_queued_sentences + 1
+        synthesis_seconds = metrics.histogram("synthesis time").mean() / 1000 or 1.0
+        retry_after = max(retry_after, excess * synthesis_seconds / synthesis_worker_count)
+    return max(1, math.ceil(retry_after)) if retry_after > 0 else None
+
+# Times every transcript fragment carries, in ms
+fragment_time_fields = ("start", "end", "connection start", "caller-posted-at", "recipient-posted-at")
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Handle synthesis requests and set complete sentences for synthesis. The body is one fragment of transcript,
+# or a batch {"session id": ..., "fragments": [...]} of one session's fragments, buffered in order under a
+# single acquisition of its buffer lock. Each fragment of a batch is measured as if it had been posted alone
+def handle_synthesis(data):
+    # Check if the model is loaded
+    if model_registry.active is None:
+        return {"status": "error", "message": "No model loaded."}, 400, {}
+    received_at = time.time() * 1000
+    batch = "fragments" in data
+    fragments = data["fragments"] if batch else [data]
+    if not isinstance(fragments, list) or not all(isinstance(fragment, dict) for fragment in fragments):
+        return {"status": "error", "message": "fragments must be a list of objects."}, 400, {}
+    if not all(isinstance(fragment.get("transcript", ""), str) for fragment in fragments):
+        return {"status": "error", "message": "transcript must be a string."}, 400, {}
+    fragments = [fragment for fragment in fragments if fragment.get("transcript", "").strip()]
+    if not fragments:
+        return {"status": "error", "message": "No text provided."}, 400, {}
+    if not isinstance(data.get("session id", default_session_id), str):
+        return {"status": "error", "message": "session id must be a string."}, 400, {}
+    # Checked before anything is recorded or buffered, so a rejected request changes nothing and can be retried
+    for index, fragment in enumerate(fragments):
+        missing = [field for field in fragment_time_fields if not is_number(fragment.get(field))]
+        if missing:
+            where = f"Fragment {index}" if batch else "Fragment"
+            return {"status": "error", "message": f"{where} is missing {', '.join(missing)}."}, 400, {}
+    session = get_session(data.get("session id", default_session_id))
+
+    retry_after = admission_retry_after(session)
+    if retry_after is not None:
+        metrics.increment("rejected requests")
+        return {"status": "error", "message": "Synthesis backlog is full, retry later.", "session id": session.session_id}, 429, {"Retry-After": str(retry_after)}
+
+    for fragment in fragments:
+        # transmission time - how long it takes the transcription to get from the caller to the recipient
+        transmission_time = fragment.get("recipient-posted-at") - (fragment.get("caller-posted-at") - 700)
+        record_metric("transmission time", transmission_time)
+        # transcription time - how long it takes for audio to be transcribed and get to the callers web app
+        transcription_time = fragment.get("caller-posted-at") - (fragment.get("connection start") + fragment.get("end"))
+        record_metric("transcription time", transcription_time, key=fragment["transcript"].strip())
+
+    text_buffer = session.text_buffer
+    with session.buffer_lock:
+        for fragment in fragments:
+            text = fragment["transcript"].strip()
+            if not session.segmenter.text:
+                text_buffer["start"] = fragment.get("start")
+            text_buffer["end"] = fragment.get("end")
+            text_buffer["connection start"] = fragment.get("connection start") - 700
+            # A speculation that doesn't end at a clause boundary can't match the sentence once more text arrives
+            if session.speculation is not None and not session.speculation.text.endswith((",", ";", ":")):
+                cancel_speculation(session, session.speculation)
+                session.speculation = None
+            session.segmenter.append(text, time.time())
+            if tracer is not None:
+                session.trace_fragments.append((received_at, time.time() * 1000, text))
+            drain_segments(session, time.time())
+    with segment_flush_cond:
+        segment_flush_cond.notify()
+
+    body = {"status": "success", "message": "Text buffered, synthesis triggered if sentence complete.", "session id": session.session_id}
+    if batch:
+        body["fragments"] = len(fragments)
+    return body, 200, {}
+
+# Result of one message on a streaming ingest channel, what /synthesis would have answered plus its status code
+def ingest_result(body, status, headers):
+    result = {**body, "code": status}
+    if "Retry-After" in headers:
+        result["retry after"] = int(headers["Retry-After"])
+    return result
+
+# Handle one line of a newline delimited JSON ingest stream, a fragment or a batch as /synthesis takes them
+def handle_ingest_line(line):
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return ingest_result({"status": "error", "message": "Line is not JSON."}, 400, {})
+    if not isinstance(data, dict):
+        return ingest_result({"status": "error", "message": "Line must be a JSON object."}, 400, {})
+    return ingest_result(*handle_synthesis(data))
 
-# Endpoint to handle synthesis requests and set complete sentences for synthesis
+# Handle a chunked stream of newline delimited JSON on one connection. Each line is handled as soon as it
+# arrives, the response has the result of every line in order once the stream ends
+def handle_synthesis_stream(lines):
+    results = [handle_ingest_line(line) for line in lines if line.strip()]
+    accepted = sum(result["code"] == 200 for result in results)
+    return {"status": "success" if accepted == len(results) else "error", "accepted": accepted, "results": results}, 200, {}
+
+# Endpoint to handle synthesis requests
 @app.route("/synthesis", methods=["POST"])
 def synthesis():
-    # Check if the model is loaded
-    if tts_model is None and kokoro_pipeline is None:
-        return jsonify({"status": "error", "message": "No model loaded."}), 400
-    data = request.json
-    text = data.get("transcript", "").strip()
-    if not text:
-        return jsonify({"status": "error", "message": "No text provided."}), 400
-    
-    # transmission time - how long it takes the transcription to get from the caller to the recipient
-    transmission_time = data.get("recipient-posted-at") - (data.get("caller-posted-at") - 700)
-    testing_logs["transmission time"].append(transmission_time)
-    # transcription time - how long it takes for audio to be transcribed and get to the callers web app
-    transcription_time = data.get("caller-posted-at") - (data.get("connection start") + data.get("end"))
-    testing_logs["transcription time"][text] = transcription_time
-
-    global text_buffer
-    with buffer_lock:
-        if text_buffer["text"] == "":
-            text_buffer["start"] = data.get("start")
-        text_buffer["text"] += " " + text
-        text_buffer["end"] = data.get("end")
-        text_buffer["text"] = text_buffer["text"].strip()
-
-        while True:
-            sentence, rest = split_sentence(text_buffer["text"])
-            if not sentence:
-                break
-
-            duration_ms = text_buffer["end"] - text_buffer["start"]
-            total_chars = len(text_buffer["text"])
-            sentence_chars = len(sentence)
-
-            estimated_sentence_end = text_buffer["start"] + int((sentence_chars / total_chars) * duration_ms)
-
-            sequence_id = next(synthesis_counter)
-            Thread(
-                target=synthesize,
-                args=(sentence, text_buffer["start"], estimated_sentence_end, sequence_id, request.json.get("connection start")-700),
-                daemon=True
-            ).start()
-
-            if not rest.strip():
-                text_buffer["text"] = ""
-                text_buffer["start"] = None
-                break
-            else:
-                text_buffer["text"] = rest.strip()
-                text_buffer["start"] = estimated_sentence_end
+    body, status, headers = handle_synthesis(request.json)
+    return jsonify(body), status, headers
 
-    return jsonify({"status": "success", "message": "Text buffered, synthesis triggered if sentence complete."})
+# Endpoint taking a chunked stream of newline delimited JSON fragments
+@app.route("/synthesis_stream", methods=["POST"])
+def synthesis_stream():
+    body, status, headers = handle_synthesis_stream(request.stream)
+    return jsonify(body), status, headers
 
-Thread(target=playback_worker, daemon=True).start()
+for _ in range(max(synthesis_worker_count, batch_max_size) if micro_batcher is not None else synthesis_worker_count):
+    Thread(target=synthesis_worker, daemon=True).start()
+metrics.set_gauge("sessions", lambda: len(sessions))
+metrics.set_gauge("queued sentences", lambda: synthesis_queue_length)
+metrics.set_gauge("resident model bytes", lambda: model_registry.stats()["resident bytes"])
+metrics.set_gauge("g2p sentence cache hit rate", lambda: (active_kokoro_cache_stats() or {}).get("sentences", {}).get("hit rate", 0.0))
+metrics.set_gauge("g2p word cache hit rate", lambda: (active_kokoro_cache_stats() or {}).get("words", {}).get("hit rate", 0.0))
+metrics.set_gauge("voice pack hit rate", lambda: (active_kokoro_cache_stats() or {}).get("voice packs", {}).get("hit rate", 0.0))
+if micro_batcher is not None:
+    metrics.set_gauge("micro batch size limit", micro_batcher.batch_size)
+if audio_cache is not None:
+    metrics.set_gauge("audio cache hit rate", lambda: audio_cache.stats()["hit rate"])
+Thread(target=segment_flush_worker, daemon=True).start()
 
-# Endpoint set the voice for the TTS model
-@app.route("/set_voice", methods=["POST"])
-def set_voice():
-    global voice
-    allowed_voices = {"af_heart", "af_bella", "am_fenrir", "am_michael"}  # Example list
-    requested_voice = request.json.get("voice", "af_heart")
+# Set the voice for the TTS model, per session
+def handle_set_voice(data):
+    requested_voice = data.get("voice", "af_heart")
+    session = get_session(data.get("session id", default_session_id))
+    # Coqui voice cloning reference, its conditioning is computed now rather than on the next sentence
+    speaker_wav = resolve_speaker_wav(data["speaker wav"]) if "speaker wav" in data else session.speaker_wav
+    if speaker_wav is None:
+        return {"status": "error", "message": f"Unknown speaker wav {data['speaker wav']}.", "session id": session.session_id}, 400, {}
+    preload_speaker_conditioning([speaker_wav])
 
     if requested_voice in allowed_voices:
-        voice = requested_voice
+        session.voice = requested_voice
     else:
-        voice = "af_heart"
-    return jsonify({"status": "success", "selected_voice": voice})
+        session.voice = "af_heart"
+    session.speaker_wav = speaker_wav
+    return {"status": "success", "selected_voice": session.voice, "speaker wav": session.speaker_wav, "session id": session.session_id}, 200, {}
+
+@app.route("/set_voice", methods=["POST"])
+def set_voice():
+    body, status, headers = handle_set_voice(request.json)
+    return jsonify(body), status, headers
+
+# End a call, stops its playback and frees its state
+def handle_end_session(data):
+    session_id = data.get("session id", default_session_id)
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return {"status": "error", "message": f"Unknown session {session_id}."}, 404, {}
+    with session.synthesis_ready:
+        session.closed = True
+        session.synthesis_ready.notify_all()
+    purge_queued_sentences(session)
+    with session.buffer_lock:
+        if session.speculation is not None:
+            cancel_speculation(session, session.speculation)
+            session.speculation = None
+    return {"status": "success", "session id": session_id}, 200, {}
+
+# Drop an ended session's queued jobs. Matched by session object, a new session may already use its id
+def purge_queued_sentences(session):
+    global synthesis_queue_length
+    with synthesis_queue_cond:
+        queue = synthesis_queues.get(session.session_id)
+        if queue is None:
+            return
+        kept = [entry for entry in queue if entry[4][0] is not session]
+        synthesis_queue_length -= len(queue) - len(kept)
+        if kept:
+            heapq.heapify(kept)
+            synthesis_queues[session.session_id] = kept
+        else:
+            del synthesis_queues[session.session_id]
+
+@app.route("/end_session", methods=["POST"])
+def end_session():
+    body, status, headers = handle_end_session(request.json)
+    return jsonify(body), status, headers
+
+# Liveness, the process is up and answering requests
+def handle_healthz():
+    return {"status": "ok", "uptime seconds": time.perf_counter() - server_import_start}, 200, {}
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    body, status, headers = handle_healthz()
+    return jsonify(body), status, headers
+
+# Readiness, a model is loaded and warmed so /synthesis will accept text. 503 until then
+def handle_readyz():
+    model_stats = model_registry.stats()
+    ready = model_stats["active"] is not None
+    body = {
+        "ready": ready,
+        "model": model_stats["active"],
+        "resident models": list(model_stats["resident"]),
+        "loading": model_loading,
+        "error": model_error,
+        "startup phases ms": dict(startup_phases)
+    }
+    return body, 200 if ready else 503, {}
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    body, status, headers = handle_readyz()
+    return jsonify(body), status, headers
+
+# The sampled sentence traces in the Chrome trace event format, to open in chrome://tracing or ui.perfetto.dev
+def handle_traces():
+    if tracer is None:
+        return {"status": "error", "message": "Tracing is off, set TRACE_SAMPLE_RATE above 0."}, 404, {}
+    return tracer.chrome_trace(), 200, {}
+
+@app.route("/traces", methods=["GET"])
+def traces():
+    body, status, headers = handle_traces()
+    return jsonify(body), status, headers
+
+# Endpoint streaming a session's audio as Ogg Opus, when the server runs with AUDIO_SINK=opus. The session
+# must have been started by /synthesis or /set_voice
+@app.route("/audio/<session_id>", methods=["GET"])
+def stream_audio(session_id):
+    session = find_session(session_id)
+    if session is None:
+        return jsonify({"status": "error", "message": f"Unknown session {session_id}."}), 404
+    if not isinstance(session.audio_sink, OpusStreamSink):
+        return jsonify({"status": "error", "message": "Audio streaming needs AUDIO_SINK=opus."}), 404
+    return Response(stream_with_context(session.audio_sink.listen()), mimetype="audio/ogg")
+
+# Phoneme and voice pack cache stats of the active Kokoro pipeline, None for other models and the process backend
+def active_kokoro_cache_stats():
+    active = model_registry.active
+    return kokoro_cache_stats(active.model) if active is not None else None
+
+# Testing logs in their JSON layout, with cache stats and a summary of the live metrics
+def export_testing_logs():
+    logs = {name: list(log) if isinstance(log, deque) else dict(log) for name, log in testing_logs.items()}
+    if audio_cache is not None:
+        logs["audio cache"] = audio_cache.stats()
+    logs["metrics"] = metrics.snapshot()
+    logs["startup"] = dict(startup_phases)
+    logs["models"] = model_registry.stats()
+    logs["speaker conditioning"] = speaker_conditioning.stats()
+    logs["kokoro caches"] = active_kokoro_cache_stats()
+    if micro_batcher is not None:
+        logs["micro batching"] = micro_batcher.stats()
+    if tracer is not None:
+        logs["tracing"] = tracer.stats()
+    return logs
+
+# Endpoint serving the live metrics in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+# Endpoint serving the testing logs as they would be saved at exit
+@app.route("/testing_logs", methods=["GET"])
+def testing_logs_endpoint():
+    return jsonify(export_testing_logs())
 
 def save_testing_logs():
     if testing_logs:  # Only if there are logs
-        avg_transcription = np.mean(list(testing_logs["transcription time"].values())) if testing_logs["transcription time"] else 0
-        avg_synthesis = np.mean(list(testing_logs["synthesis time"].values())) if testing_logs["synthesis time"] else 0
-        avg_transmission = np.mean(testing_logs["transmission time"]) if testing_logs["transmission time"] else 0
-        avg_playback = np.mean(testing_logs["playback time"]) if testing_logs["playback time"] else 0
-        avg_latency = np.mean(testing_logs["system latency"]) if testing_logs["system latency"] else 0
+        # Averages come from the metrics, which cover the whole run rather than the entries kept in the logs
+        avg_transcription = metrics.histogram("transcription time").mean()
+        avg_synthesis = metrics.histogram("synthesis time").mean()
+        avg_transmission = metrics.histogram("transmission time").mean()
+        avg_playback = metrics.histogram("playback time").mean()
+        avg_latency = metrics.histogram("system latency").mean()
+        avg_queue_depth = metrics.histogram("queue depth").mean()
+        avg_queue_wait = metrics.histogram("queue wait time").mean()
+        avg_first_audio = metrics.histogram("time to first audio").mean()
+        speculation_saved = metrics.histogram("speculation saved time")
+        speculation_wasted = metrics.histogram("speculation wasted time")
 
         print("\n=== Test Results Summary ===")
         print(f"Average Transcription Time: {avg_transcription:.3f} ms")
@@ -228,12 +1142,38 @@ def save_testing_logs():
         print(f"Average Transmission Time: {avg_transmission:.3f} ms")
         print(f"Average Playback Time: {avg_playback:.3f} ms")
         print(f"Average System Latency: {avg_latency:.3f} ms")
+        print(f"Average Queue Depth: {avg_queue_depth:.3f}")
+        print(f"Average Queue Wait Time: {avg_queue_wait:.3f} ms")
+        print(f"Average Time To First Audio: {avg_first_audio:.3f} ms")
+        if deadline_policy != "none":
+            snapshot = metrics.snapshot()
+            print(f"Missed Deadlines: {snapshot.get('missed deadlines', 0)} | Skipped: {snapshot.get('skipped sentences', 0)} | "
+                  f"Merged: {snapshot.get('merged sentences', 0)} | Sped Up: {snapshot.get('sped up sentences', 0)}")
+        if speculative_synthesis:
+            print(f"Speculation Latency Saved: {speculation_saved.sum:.3f} ms over {speculation_saved.count} sentences")
+            print(f"Speculation Compute Wasted: {speculation_wasted.sum:.3f} ms over {speculation_wasted.count} cancellations")
+
+        logs = export_testing_logs()
+        if audio_cache is not None:
+            cache_stats = logs["audio cache"]
+            audio_cache.flush()
+            print(f"Audio Cache Hit Rate: {cache_stats['hit rate']:.3f} ({cache_stats['hits']} hits, {cache_stats['misses']} misses)")
 
+        if latency_log is not None:
+            # Everything was appended to the latency log as it happened
+            latency_log.close()
+            print(f"Latency log saved to {latency_log.directory}, tests/convert_latency_log.py turns it into testing_logs.json")
+            return
         # Save to file
         with open("testing_logs.json", "w") as f:
-            json.dump(testing_logs, f, indent=4)
+            json.dump(logs, f, indent=4)
         print("Testing logs saved to testing_logs.json")
 
+startup_phases["server import"] = (time.perf_counter() - server_import_start) * 1000
+# Synthesis processes import the main module again when they start, they must not preload a model of their own
+if preload_model_name and mp.parent_process() is None:
+    Thread(target=load_model_now, args=(preload_model_name,), daemon=True).start()
+
 if __name__ == "__main__":
     atexit.register(save_testing_logs)
     app.run(debug=False)
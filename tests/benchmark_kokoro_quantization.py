@@ -0,0 +1,94 @@
+import copy, glob, json, os, statistics, sys, time
+import numpy as np
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, "..")
+from kokoro_quantization import quantize_kokoro, waveform_difference
+from synthesis_processes import to_int16
+
+# Accuracy and latency of Kokoro int8 ("kokoro-int8") against fp32 Kokoro on CPU, over the sentences
+# synthesized in the recorded test runs (the keys of "synthesis time" in test_results/*/testing_logs.json).
+# Both models get the same random seed for every sentence, so the harmonic source's random phase and
+# noise are the same and what differs is quantization. Fails when the int8 audio drifts further from the
+# fp32 audio than MAX_LOG_SPECTRAL_DISTANCE_DB or MAX_LENGTH_CHANGE on average.
+#  python benchmark_kokoro_quantization.py [torch threads]
+
+VOICE = "af_heart"
+SPEED = 1.0
+SAMPLE_RATE = 24000
+REPEATS = 3
+MAX_LOG_SPECTRAL_DISTANCE_DB = 3.0
+MAX_LENGTH_CHANGE = 0.03
+
+os.makedirs('./graphs', exist_ok=True)
+
+# Recorded sentences and the synthesis times the server logged for them, in ms
+def load_sentences():
+    recorded = {}
+    for path in sorted(glob.glob('./test_results/*/testing_logs.json')):
+        with open(path) as f:
+            for sentence, ms in json.load(f).get("synthesis time", {}).items():
+                recorded.setdefault(sentence, []).append(ms[0] if isinstance(ms, list) else ms)
+    return recorded
+
+def synthesize(torch, pipeline, sentence):
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    audio = np.concatenate([to_int16(audio) for _, _, audio in pipeline(sentence, voice=VOICE, speed=SPEED)])
+    return audio, (time.perf_counter() - start) * 1000
+
+if __name__ == "__main__":
+    import torch
+    from kokoro import KPipeline
+    torch.set_num_threads(int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1))
+    recorded = load_sentences()
+    sentences = list(recorded)
+    if not sentences:
+        sys.exit("No recorded sentences in ./test_results")
+
+    fp32 = KPipeline(lang_code='a')
+    int8 = quantize_kokoro(KPipeline(lang_code='a', model=copy.deepcopy(fp32.model)))
+    for pipeline in (fp32, int8):
+        synthesize(torch, pipeline, sentences[0])
+    print(f"{len(sentences)} recorded sentences, {torch.get_num_threads()} torch threads")
+
+    results = []
+    for sentence in sentences:
+        reference, fp32_ms = min((synthesize(torch, fp32, sentence) for _ in range(REPEATS)), key=lambda r: r[1])
+        candidate, int8_ms = min((synthesize(torch, int8, sentence) for _ in range(REPEATS)), key=lambda r: r[1])
+        difference = waveform_difference(reference, candidate)
+        results.append({"sentence": sentence, "audio seconds": len(reference) / SAMPLE_RATE, "fp32 ms": fp32_ms,
+                        "int8 ms": int8_ms, "recorded ms": statistics.median(recorded[sentence]), **difference})
+
+    audio_seconds = sum(r["audio seconds"] for r in results)
+    distance = statistics.mean(r.get("log spectral distance db", 0.0) for r in results)
+    length_change = statistics.mean(abs(r["length ratio"] - 1) for r in results)
+    same_length = [r["snr db"] for r in results if "snr db" in r]
+    for model in ("fp32", "int8"):
+        total = sum(r[f"{model} ms"] for r in results)
+        print(f"  {model} | median {statistics.median(r[f'{model} ms'] for r in results):7.1f} ms per sentence | "
+              f"real time factor {total / 1000 / audio_seconds:.3f}")
+    print(f"  recorded synthesis time median {statistics.median(r['recorded ms'] for r in results):.1f} ms per sentence")
+    print(f"  int8 speedup {sum(r['fp32 ms'] for r in results) / sum(r['int8 ms'] for r in results):.2f}x")
+    print(f"  log spectral distance {distance:.2f} dB | length change {length_change * 100:.2f}% | "
+          f"{len(same_length)}/{len(results)} same length" + (f", median SNR {statistics.median(same_length):.1f} dB" if same_length else ""))
+
+    with open('./graphs/kokoro_quantization.json', 'w') as f:
+        json.dump(results, f, indent=4)
+    order = np.argsort([r["audio seconds"] for r in results])
+    plt.figure(figsize=(10, 6))
+    for model in ("fp32", "int8", "recorded"):
+        plt.plot([results[i]["audio seconds"] for i in order], [results[i][f"{model} ms"] for i in order], marker='o', label=model)
+    plt.xlabel('Sentence audio (s)')
+    plt.ylabel('Synthesis time (ms)')
+    plt.title(f'Kokoro fp32 vs int8 on CPU ({torch.get_num_threads()} threads)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig('./graphs/kokoro_quantization.png')
+    plt.close()
+
+    if distance > MAX_LOG_SPECTRAL_DISTANCE_DB or length_change > MAX_LENGTH_CHANGE:
+        print("FAIL: int8 audio is too far from fp32")
+        sys.exit(1)
+    print("PASS")
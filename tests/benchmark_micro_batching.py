@@ -0,0 +1,101 @@
+import os, re, sys, time, queue
+import numpy as np
+import matplotlib.pyplot as plt
+from threading import Thread
+
+sys.path.insert(0, "..")
+from micro_batching import MicroBatcher
+
+# Throughput of micro-batched Kokoro synthesis on CPU against synthesizing one sentence at a time. Every
+# run synthesizes the same sentences from the annotated transcript with all cores on one model, from as
+# many concurrent workers as the batch size the way the server's synthesis workers share its queue.
+# Also reports how long each sentence took to come back and how far the batched audio is from the
+# unbatched audio of the same sentence
+
+VOICE = "af_heart"
+SPEED = 1.1
+SENTENCE_COUNT = 32
+SAMPLE_RATE = 24000
+BATCH_SIZES = (1, 2, 4, 8)
+
+os.makedirs('./graphs', exist_ok=True)
+
+def load_sentences():
+    with open('./annotated_transcript.txt') as f:
+        text = " ".join(f.read().split())
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 4]
+    return sentences[:SENTENCE_COUNT]
+
+# Run worker_count threads that take sentences from a shared queue and synthesize them with synthesize_one,
+# returns (wall seconds, sentence -> audio, ms each sentence took)
+def run_workers(worker_count, sentences, synthesize_one):
+    jobs = queue.Queue()
+    for sentence in sentences:
+        jobs.put(sentence)
+    audio, latencies = {}, []
+
+    def work():
+        while True:
+            try:
+                sentence = jobs.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            audio[sentence] = np.concatenate(synthesize_one(sentence))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [Thread(target=work) for _ in range(worker_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, audio, latencies
+
+if __name__ == "__main__":
+    import torch
+    from kokoro import KPipeline
+    cores = os.cpu_count() or 1
+    torch.set_num_threads(cores)
+    sentences = load_sentences()
+    pipeline = KPipeline(lang_code='a')
+    # The decoder draws a random phase and noise for its harmonic source on every call. Seeding torch right
+    # before each decode, batched or not and on whichever thread runs it, makes the unbatched and batched
+    # audio of a sentence differ only by batching, so max difference shows whether they match
+    pipeline.model.decoder.register_forward_pre_hook(lambda module, args: torch.manual_seed(0))
+    next(pipeline(sentences[0], voice=VOICE, speed=SPEED))
+    print(f"{len(sentences)} sentences, {cores} cores")
+
+    def unbatched(sentence):
+        return [output.audio.numpy() for output in (result.output for result in pipeline(sentence, voice=VOICE, speed=SPEED))]
+    wall_seconds, reference, latencies = run_workers(1, sentences, unbatched)
+    audio_seconds = sum(len(wav) for wav in reference.values()) / SAMPLE_RATE
+    baseline = len(sentences) / wall_seconds
+    print(f"  unbatched      | {baseline:6.2f} sentences/s | {audio_seconds / wall_seconds:6.2f} audio s per s | "
+          f"p95 {np.percentile(latencies, 95):7.1f} ms")
+
+    throughputs = []
+    for batch_size in BATCH_SIZES:
+        # A latency bound this high never limits the batch once the first one is timed, the size is what is being measured
+        batcher = MicroBatcher(window_ms=5, max_batch_size=batch_size, max_latency_ms=60000)
+        wall_seconds, audio, latencies = run_workers(batch_size, sentences, lambda s: list(batcher.synthesize(pipeline, s, VOICE, SPEED)))
+        throughput = len(sentences) / wall_seconds
+        throughputs.append(throughput)
+        difference = max(float(np.max(np.abs(audio[s][:len(reference[s])] - reference[s][:len(audio[s])]))) for s in sentences)
+        stats = batcher.stats()
+        print(f"  batch size {batch_size:>2} | {throughput:6.2f} sentences/s | {audio_seconds / wall_seconds:6.2f} audio s per s | "
+              f"p95 {np.percentile(latencies, 95):7.1f} ms | mean batch {stats['mean batch size']:.2f} | "
+              f"speedup {throughput / baseline:.2f}x | max difference {difference:.4f}")
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(BATCH_SIZES, throughputs, marker='o', label='micro-batched')
+    plt.axhline(baseline, color='gray', linestyle='--', label='unbatched')
+    plt.xlabel('Batch Size')
+    plt.ylabel('Throughput (sentences/s)')
+    plt.title(f'Micro-batched Synthesis Throughput ({cores} cores)')
+    plt.xticks(BATCH_SIZES)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig('./graphs/micro_batching_throughput.png')
+    plt.close()
@@ -0,0 +1,98 @@
+import os, re, sys, time, queue
+import matplotlib.pyplot as plt
+from threading import Thread
+
+sys.path.insert(0, "..")
+from synthesis_processes import SynthesisProcessPool, to_int16
+
+# Throughput of the thread and process synthesis backends as the number of workers goes up. Every run
+# synthesizes the same sentences from the annotated transcript with Kokoro, split between the workers
+# the way the server's synthesis workers share its queue. Torch threads are divided between the workers
+# like the server does (TORCH_THREADS = cores / SYNTHESIS_WORKERS)
+
+VOICE = "af_heart"
+SPEED = 1.1
+SENTENCE_COUNT = 24
+SAMPLE_RATE = 24000
+
+os.makedirs('./graphs', exist_ok=True)
+
+def load_sentences():
+    with open('./annotated_transcript.txt') as f:
+        text = " ".join(f.read().split())
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 4]
+    return sentences[:SENTENCE_COUNT]
+
+# Run worker_count threads that each take sentences from a shared queue and synthesize them with
+# synthesize_one, returns (wall seconds, seconds of audio produced)
+def run_workers(worker_count, sentences, synthesize_one):
+    jobs = queue.Queue()
+    for sentence in sentences:
+        jobs.put(sentence)
+    audio_samples = [0] * worker_count
+
+    def work(index):
+        while True:
+            try:
+                sentence = jobs.get_nowait()
+            except queue.Empty:
+                return
+            audio_samples[index] += synthesize_one(sentence)
+
+    threads = [Thread(target=work, args=(i,)) for i in range(worker_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sum(audio_samples) / SAMPLE_RATE
+
+def benchmark_threads(worker_count, sentences, cores):
+    import torch
+    from kokoro import KPipeline
+    torch.set_num_threads(max(1, cores // worker_count))
+    pipeline = KPipeline(lang_code='a')
+    next(pipeline(sentences[0], voice=VOICE, speed=SPEED))
+
+    def synthesize_one(sentence):
+        return sum(len(to_int16(audio)) for _, _, audio in pipeline(sentence, voice=VOICE, speed=SPEED))
+    return run_workers(worker_count, sentences, synthesize_one)
+
+def benchmark_processes(worker_count, sentences, cores):
+    pool = SynthesisProcessPool(worker_count, max(1, cores // worker_count))
+    try:
+        pool.load("kokoro", "cpu")
+
+        def synthesize_one(sentence):
+            return sum(len(wav) for wav in pool.synthesize(sentence, VOICE, SPEED))
+        return run_workers(worker_count, sentences, synthesize_one)
+    finally:
+        pool.close()
+
+if __name__ == "__main__":
+    cores = os.cpu_count() or 1
+    sentences = load_sentences()
+    worker_counts = [n for n in (1, 2, 4, 8, 16) if n <= cores]
+    print(f"{len(sentences)} sentences, {cores} cores")
+
+    results = {"thread": [], "process": []}
+    for backend, benchmark in (("thread", benchmark_threads), ("process", benchmark_processes)):
+        for worker_count in worker_counts:
+            wall_seconds, audio_seconds = benchmark(worker_count, sentences, cores)
+            throughput = len(sentences) / wall_seconds
+            results[backend].append(throughput)
+            print(f"  {backend:<8} workers {worker_count:>2} | {throughput:6.2f} sentences/s | "
+                  f"{audio_seconds / wall_seconds:6.2f} audio s per s | speedup {throughput / results[backend][0]:.2f}x")
+
+    plt.figure(figsize=(10, 6))
+    for backend, throughputs in results.items():
+        plt.plot(worker_counts, throughputs, marker='o', label=f'{backend} backend')
+    plt.xlabel('Synthesis Workers')
+    plt.ylabel('Throughput (sentences/s)')
+    plt.title(f'Synthesis Throughput Scaling ({cores} cores)')
+    plt.xticks(worker_counts)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig('./graphs/synthesis_backend_scaling.png')
+    plt.close()
@@ -0,0 +1,48 @@
+import sys, time, wave
+import numpy as np
+
+sys.path.insert(0, "..")
+from time_stretch import wsola
+
+# CPU cost of the playback catch-up time-stretch per second of audio, to check it is cheap enough to run
+# inline in the playback workers. Stretches a wav given on the command line (16 bit mono 24 kHz, e.g. a
+# recording from the wav sink) or a synthetic voiced signal, in chunks the size the pipeline yields.
+#  python benchmark_time_stretch.py [../recordings/<session id>.wav]
+
+SAMPLE_RATE = 24000
+CHUNK_SECONDS = 2.0
+FACTORS = (1.05, 1.1, 1.2, 1.3, 1.5)
+REPEATS = 5
+
+def load_audio(path):
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1 or f.getframerate() != SAMPLE_RATE:
+            sys.exit(f"{path} must be 16 bit mono {SAMPLE_RATE} Hz")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+# Ten seconds of a gliding harmonic tone with a syllable-rate envelope, roughly like voiced speech
+def synthetic_audio(seconds=10.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(h * phase) / h for h in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    return (0.2 * voiced * envelope / np.max(np.abs(voiced)) * 32767).astype(np.int16)
+
+if __name__ == "__main__":
+    audio = load_audio(sys.argv[1]) if len(sys.argv) > 1 else synthetic_audio()
+    chunk = int(CHUNK_SECONDS * SAMPLE_RATE)
+    chunks = [audio[i:i + chunk] for i in range(0, len(audio), chunk)]
+    audio_seconds = len(audio) / SAMPLE_RATE
+    print(f"{audio_seconds:.1f} s of audio in {len(chunks)} chunks of {CHUNK_SECONDS:.1f} s")
+
+    for factor in FACTORS:
+        wall, cpu, output_samples = [], [], 0
+        for _ in range(REPEATS):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            output_samples = sum(len(wsola(c, factor)) for c in chunks)
+            wall.append(time.perf_counter() - wall_start)
+            cpu.append(time.process_time() - cpu_start)
+        print(f"  factor {factor:.2f} | {np.median(cpu) / audio_seconds * 1000:6.2f} ms CPU per audio s | "
+              f"{np.median(wall) / audio_seconds * 1000:6.2f} ms wall per audio s | "
+              f"output {output_samples / len(audio):.3f} of input length (target {1 / factor:.3f})")
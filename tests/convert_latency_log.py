@@ -0,0 +1,31 @@
+import argparse, json, os, sys, time
+
+sys.path.insert(0, "..")
+from latency_log import read_latency_log, table_length, to_testing_logs
+
+# Convert a run of the server's binary latency log to the testing_logs.json layout the other scripts read.
+# With no run given the newest one under ../latency_logs is converted:
+#  python convert_latency_log.py ../latency_logs/run-20250101-120000-1234 -o ./test_results/run1/testing_logs.json
+
+def newest_run(directory):
+    runs = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("run-")]
+    if not runs:
+        sys.exit(f"No runs in {directory}")
+    return max(runs, key=os.path.getmtime)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a binary latency log run to testing_logs.json")
+    parser.add_argument("run", nargs="?", help="run directory, the newest under ../latency_logs by default")
+    parser.add_argument("-o", "--output", default="testing_logs.json", help="JSON file to write")
+    args = parser.parse_args()
+
+    run = args.run or newest_run("../latency_logs")
+    start = time.perf_counter()
+    tables = read_latency_log(run)
+    logs = to_testing_logs(run)
+    print(f"{run}: {table_length(tables['sentences'])} sentences, {table_length(tables['measurements'])} measurements, "
+          f"converted in {(time.perf_counter() - start) * 1000:.0f} ms")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(logs, f, indent=4)
+    print(f"Testing logs saved to {args.output}")
@@ -0,0 +1,107 @@
+import json, os, sys
+import numpy as np
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, "..")
+from speed_controller import ThresholdSpeedController, LatencyTargetSpeedController
+
+# Offline evaluation of the speed controllers. Replays the sentences of each recorded run through a
+# simulated speaker -> transcription -> synthesis -> playback pipeline and compares the latency each
+# controller would have produced.
+#
+# The logs don't keep wall clock arrival times, so the speaker timeline is rebuilt from the sentence
+# lengths at SPEAKER_CHARS_PER_SECOND, and each sentence reaches the server after the run's mean
+# transcription + transmission time. Synthesis takes the recorded time for that sentence, and audio
+# length comes from the recorded playback time when the run's playback times line up with its sentences.
+
+SPEAKER_CHARS_PER_SECOND = 14.0
+VOICE = "af_heart"
+TARGET_LATENCY_SECONDS = 3.0
+
+os.makedirs('./graphs', exist_ok=True)
+
+def load_run(path):
+    with open(path) as f:
+        data = json.load(f)
+
+    sentences = []
+    playback_times = data.get("playback time", [])
+    # "synthesis time" keeps one entry per sentence text while "playback time" has one per sentence played,
+    # so they only line up by index when no sentence repeated. Otherwise use the rate model's lengths
+    if len(playback_times) != len(data["synthesis time"]):
+        print(f"  {path}: {len(data['synthesis time'])} synthesis times but {len(playback_times)} playback times, "
+              f"audio lengths come from the rate model")
+        playback_times = []
+    for i, (text, value) in enumerate(data["synthesis time"].items()):
+        synth_ms, speed = (value[0], value[1]) if isinstance(value, list) else (value, 1.0)
+        # Audio length at speed 1.0, None when the run didn't record a playback time for it
+        audio_seconds = playback_times[i] / 1000 * speed if i < len(playback_times) else None
+        sentences.append((text, synth_ms / 1000, speed, audio_seconds))
+
+    transcription = list(data["transcription time"].values())
+    transmission = data.get("transmission time", [])
+    pipeline_delay = (np.mean(transcription) if transcription else 0) + (np.mean(transmission) if transmission else 0)
+    return sentences, pipeline_delay / 1000
+
+def simulate(controller, sentences, pipeline_delay):
+    speech_start = 0.0
+    worker_free = 0.0
+    play_end = 0.0
+    latencies, speeds = [], []
+    for text, synth_seconds, recorded_speed, audio_seconds in sentences:
+        speech_end = speech_start + len(text) / SPEAKER_CHARS_PER_SECOND
+        arrival = speech_end + pipeline_delay
+
+        synth_start = max(arrival, worker_free)
+        backlog = max(0.0, play_end - synth_start)
+        speed = controller.choose_speed(text, VOICE, backlog, 0.0)
+
+        # Synthesis work scales with the length of the audio produced
+        synth_end = synth_start + synth_seconds * recorded_speed / speed
+        worker_free = synth_end
+        if audio_seconds is None:
+            audio_seconds = controller.rate_model.predict_seconds(VOICE, text)
+        duration = audio_seconds / speed
+        controller.observe(text, VOICE, duration, speed)
+
+        play_start = max(synth_end, play_end)
+        play_end = play_start + duration
+        latencies.append(((play_start - speech_start) + (play_end - speech_end)) / 2)
+        speeds.append(speed)
+        speech_start = speech_end
+    return np.array(latencies), np.array(speeds)
+
+def summarize(name, latencies, speeds):
+    speed_swing = np.mean(np.abs(np.diff(speeds))) if len(speeds) > 1 else 0
+    print(f"  {name:<10} mean latency {np.mean(latencies):7.2f} s | p95 {np.percentile(latencies, 95):7.2f} s | "
+          f"max {np.max(latencies):7.2f} s | mean speed {np.mean(speeds):.2f} | mean speed change {speed_swing:.3f}")
+
+for folder in sorted(os.listdir('./test_results')):
+    path = f'./test_results/{folder}/testing_logs.json'
+    if not os.path.exists(path):
+        continue
+    sentences, pipeline_delay = load_run(path)
+    if not sentences:
+        continue
+
+    print(f"\n=== {folder} ({len(sentences)} sentences, pipeline delay {pipeline_delay:.2f} s) ===")
+    results = {}
+    for name, controller in (
+        ("threshold", ThresholdSpeedController()),
+        ("latency", LatencyTargetSpeedController(target_seconds=TARGET_LATENCY_SECONDS))
+    ):
+        latencies, speeds = simulate(controller, sentences, pipeline_delay)
+        summarize(name, latencies, speeds)
+        results[name] = latencies
+
+    plt.figure(figsize=(12, 6))
+    for name, latencies in results.items():
+        plt.plot(latencies, label=f'{name} controller')
+    plt.xlabel('Sentence Index')
+    plt.ylabel('Simulated System Latency (s)')
+    plt.title(f'Speed Controller Comparison - {folder}')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(f'./graphs/speed_controller_{folder}.png')
+    plt.close()
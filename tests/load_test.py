@@ -0,0 +1,188 @@
+import argparse, json, os, sys, time, urllib.request, urllib.error
+import numpy as np
+from threading import Thread
+
+sys.path.insert(0, "..")
+
+# Load test for the synthesis server. Replays a recorded transcript against /synthesis from one or more
+# concurrent sessions and reports time to first audio, system latency, ingest latency and throughput as JSON.
+#
+# The transcript is the list of fragments a live call posted, taken from a run's testing_logs.json (or a .txt
+# file split into fragments). The logs don't keep arrival times, so like evaluate_speed_controller.py the
+# speaker timeline is rebuilt from the fragment lengths at SPEAKER_CHARS_PER_SECOND, divided by --rate.
+#
+# By default the server runs in this process with the null audio sink, so no audio device is needed:
+#  python load_test.py --model fake --sessions 4 --rate 4 --output ./load_test_results/fake_4x.json
+# --url sends the requests to a running server instead; start it with AUDIO_SINK=null and fresh metrics
+
+SPEAKER_CHARS_PER_SECOND = 14.0
+DEFAULT_TRANSCRIPT = './test_results/run1_small/testing_logs.json'
+
+def load_fragments(path, limit):
+    if path.endswith(".json"):
+        with open(path) as f:
+            fragments = list(json.load(f)["transcription time"])
+    else:
+        with open(path) as f:
+            words = f.read().split()
+        fragments = [" ".join(words[i:i + 8]) for i in range(0, len(words), 8)]
+    return fragments[:limit] if limit else fragments
+
+# Calls the server in this process through Flask's test client
+class InProcessClient:
+    def __init__(self, realtime_sink):
+        os.environ.setdefault("AUDIO_SINK", "null")
+        os.environ.setdefault("SINK_REALTIME", "1" if realtime_sink else "0")
+        os.environ.setdefault("AUDIO_CACHE_MB", "0")
+        import synthesis_server
+        self.client = synthesis_server.app.test_client()
+
+    def post(self, path, body):
+        response = self.client.post(path, json=body)
+        return response.status_code, response.get_json(), response.headers
+
+    def get(self, path):
+        return self.client.get(path).get_json()
+
+# Calls a running server over HTTP
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def post(self, path, body):
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response), response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e), e.headers
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.load(response)
+
+# Post every fragment of the transcript at the time the speaker would have finished it, as a
+# transcription service would, recording the round trip time of each request in ms and its status code.
+# A fragment the server pushes back on is sent again after its Retry-After delay
+def replay_session(client, session_id, fragments, rate, start_delay, ingest_times, statuses):
+    time.sleep(start_delay)
+    connection_start = time.time() * 1000
+    speech_ms = 0.0
+    for fragment in fragments:
+        fragment_start = speech_ms
+        speech_ms += len(fragment) / SPEAKER_CHARS_PER_SECOND * 1000 / rate
+        delay = connection_start + speech_ms - time.time() * 1000
+        if delay > 0:
+            time.sleep(delay / 1000)
+        while True:
+            posted_at = time.time() * 1000
+            status, _, headers = client.post("/synthesis", {
+                "session id": session_id,
+                "transcript": fragment,
+                "start": fragment_start,
+                "end": speech_ms,
+                # The server takes 700 ms off both of these for the caller's clock offset
+                "connection start": connection_start + 700,
+                "caller-posted-at": posted_at + 700,
+                "recipient-posted-at": posted_at
+            })
+            ingest_times.append(time.time() * 1000 - posted_at)
+            statuses.append(status)
+            if status != 429:
+                break
+            time.sleep(float(headers.get("Retry-After", 1)))
+
+# Wait until the queue is empty and no sentence has finished playing for settle_seconds
+def wait_for_playback(client, settle_seconds, timeout_seconds):
+    deadline = time.time() + timeout_seconds
+    last_count, last_change = -1, time.time()
+    while time.time() < deadline:
+        snapshot = client.get("/testing_logs")["metrics"]
+        count = snapshot.get("system latency", {}).get("count", 0)
+        if count != last_count:
+            last_count, last_change = count, time.time()
+        elif snapshot.get("queued sentences", 0) == 0 and time.time() - last_change >= settle_seconds:
+            return True
+        time.sleep(0.2)
+    return False
+
+def percentiles(summary):
+    return {key: summary.get(key) for key in ("count", "mean", "p50", "p95", "p99", "max")} if summary else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a transcript against /synthesis and report latency percentiles")
+    parser.add_argument("--transcript", default=DEFAULT_TRANSCRIPT, help="testing_logs.json of a recorded run, or a .txt transcript")
+    parser.add_argument("--limit", type=int, default=0, help="fragments to replay per session, 0 for all")
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent sessions")
+    parser.add_argument("--stagger", type=float, default=0.25, help="seconds between session starts")
+    parser.add_argument("--rate", type=float, default=1.0, help="replay speed, 1 is real time")
+    parser.add_argument("--model", default="fake", help="model to load, fake for the deterministic backend or kokoro")
+    parser.add_argument("--url", help="URL of a running server, otherwise the server runs in this process")
+    parser.add_argument("--realtime-sink", choices=("auto", "yes", "no"), default="auto",
+                        help="consume audio at playback speed, auto means only when --rate is 1")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for playback to finish")
+    parser.add_argument("--output", help="file to write the JSON report to, printed when not given")
+    args = parser.parse_args()
+
+    realtime_sink = args.realtime_sink == "yes" or (args.realtime_sink == "auto" and args.rate == 1)
+    client = HttpClient(args.url) if args.url else InProcessClient(realtime_sink)
+    status, body, _ = client.post("/load_model", {"model": args.model})
+    if status != 200:
+        sys.exit(f"Loading {args.model} failed: {body}")
+
+    fragments = load_fragments(args.transcript, args.limit)
+    ingest_times, statuses = [], []
+    threads = [
+        Thread(target=replay_session, args=(client, f"load-test-{i}", fragments, args.rate, i * args.stagger, ingest_times, statuses))
+        for i in range(args.sessions)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished = wait_for_playback(client, settle_seconds=2.0, timeout_seconds=args.timeout)
+    duration = time.time() - start
+    for i in range(args.sessions):
+        client.post("/end_session", {"session id": f"load-test-{i}"})
+
+    snapshot = client.get("/testing_logs")["metrics"]
+    playback = snapshot.get("playback time", {})
+    sentences = snapshot.get("system latency", {}).get("count", 0)
+    report = {
+        "model": args.model,
+        "sessions": args.sessions,
+        "rate": args.rate,
+        "fragments per session": len(fragments),
+        "realtime sink": realtime_sink,
+        "finished": finished,
+        "duration seconds": duration,
+        "requests": len(statuses),
+        "rejected requests": sum(status == 429 for status in statuses),
+        "failed requests": sum(status not in (200, 429) for status in statuses),
+        "time to first audio ms": percentiles(snapshot.get("time to first audio")),
+        "system latency ms": percentiles(snapshot.get("system latency")),
+        "synthesis time ms": percentiles(snapshot.get("synthesis time")),
+        "queue wait time ms": percentiles(snapshot.get("queue wait time")),
+        "ingest latency ms": {
+            "count": len(ingest_times),
+            "mean": float(np.mean(ingest_times)) if ingest_times else None,
+            **{f"p{q}": float(np.percentile(ingest_times, q)) if ingest_times else None for q in (50, 95, 99)},
+            "max": float(np.max(ingest_times)) if ingest_times else None
+        },
+        "throughput": {
+            "sentences per second": sentences / duration,
+            "audio seconds per second": playback.get("mean", 0) * playback.get("count", 0) / 1000 / duration
+        }
+    }
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    sys.exit(0 if finished else 1)
+
+if __name__ == "__main__":
+    main()
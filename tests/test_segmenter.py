@@ -0,0 +1,48 @@
+import sys
+
+sys.path.insert(0, "..")
+from segmenter import IncrementalSegmenter
+
+# Sentence boundary regressions for the segmenter. Runs as a script or under pytest:
+#  python test_segmenter.py
+
+# Segments the text splits into right away, and what is left waiting in the buffer
+def split(text):
+    segmenter = IncrementalSegmenter(max_words=50)
+    segmenter.append(text, 0)
+    segments = []
+    while (segment := segmenter.next_segment(0)) is not None:
+        segments.append(segment)
+    return segments, segmenter.text
+
+def test_short_replies_split_at_once():
+    assert split("Oh no. I don't think so.") == (["Oh no.", "I don't think so."], "")
+    assert split("So did I. Then we left.") == (["So did I.", "Then we left."], "")
+    assert split("We met in Jan. It was cold.") == (["We met in Jan.", "It was cold."], "")
+    assert split("No.") == (["No."], "")
+
+def test_titles_never_end_a_sentence():
+    assert split("Dr. Smith is here. Hi.") == (["Dr. Smith is here.", "Hi."], "")
+    assert split("Ask Mrs. Jones") == ([], "Ask Mrs. Jones")
+
+def test_dotted_acronyms():
+    assert split("U.S.A. is big. Yes.") == (["U.S.A. is big.", "Yes."], "")
+    assert split("I live in the U.S.A. Then I moved.") == (["I live in the U.S.A.", "Then I moved."], "")
+    assert split("We left at 10 a.m. now it is late. Ok.") == (["We left at 10 a.m. now it is late.", "Ok."], "")
+    assert split("See you at 5 p.m. tomorrow. Bye.") == (["See you at 5 p.m. tomorrow.", "Bye."], "")
+
+def test_initials():
+    assert split("Books by J. R. R. Tolkien are long. Yes.") == (["Books by J. R. R. Tolkien are long.", "Yes."], "")
+    assert split("The author J. K. Rowling wrote it. Yes.") == (["The author J. K. Rowling wrote it.", "Yes."], "")
+
+def test_numbers_and_ellipses():
+    assert split("Pi is 3.14 today. Yes.") == (["Pi is 3.14 today.", "Yes."], "")
+    assert split("See fig. 3 for details. Ok.") == (["See fig. 3 for details.", "Ok."], "")
+    assert split("Wait... what? ok") == (["Wait...", "what?"], "ok")
+
+if __name__ == "__main__":
+    tests = [(name, test) for name, test in list(globals().items()) if name.startswith("test_")]
+    for name, test in tests:
+        test()
+        print(f"  {name} ok")
+    print(f"{len(tests)} passed")
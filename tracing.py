@@ -0,0 +1,66 @@
+import random
+from collections import deque
+from threading import Lock
+
+# Per-sentence traces of the pipeline, exported in the Chrome trace event format that chrome://tracing and
+# ui.perfetto.dev open. A sampled sentence keeps the fragments of transcript it was built from and the time
+# it reached each stage: received and buffered per fragment, split from the buffer, queued, synthesis
+# start, first audio and end, and playback start and end. Each session shows as a process with one track
+# per sequence id. Sampling is decided once per sentence, unsampled sentences cost one random number
+
+# Spans drawn for each sentence, between two of its stage times
+spans = (
+    ("buffered", "buffered", "split"),
+    ("queued", "queued at", "synthesis start"),
+    ("synthesis", "synthesis start", "synthesis end"),
+    ("waiting for playback", "synthesis end", "playback start"),
+    ("playback", "playback start", "playback end")
+)
+
+class Tracer:
+    def __init__(self, sample_rate=0.01, max_traces=1000):
+        self.sample_rate = sample_rate
+        self.lock = Lock()
+        self.traces = deque(maxlen=max_traces)  # finished traces, oldest dropped first
+        self.traced = 0
+
+    def sample(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    # A sampled sentence that has finished. timings maps stage names to times in ms, fragments is a list
+    # of (received at, buffered at, text) for the transcript fragments it was split from
+    def record(self, session_id, sid, text, timings, fragments):
+        with self.lock:
+            self.traces.append((session_id, sid, text, dict(timings), list(fragments)))
+            self.traced += 1
+
+    def chrome_trace(self):
+        with self.lock:
+            traces = list(self.traces)
+        events = []
+        pids = {}
+        for session_id, sid, text, timings, fragments in traces:
+            if session_id not in pids:
+                pids[session_id] = len(pids) + 1
+                events.append({"name": "process_name", "ph": "M", "pid": pids[session_id], "args": {"name": f"session {session_id}"}})
+            pid = pids[session_id]
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": sid, "args": {"name": f"sentence {sid}"}})
+            for received_at, buffered_at, fragment in fragments:
+                events.append({"name": "fragment received", "ph": "X", "pid": pid, "tid": sid, "ts": received_at * 1000,
+                               "dur": (buffered_at - received_at) * 1000, "args": {"text": fragment}})
+            if fragments and "split" in timings:
+                timings = {**timings, "buffered": fragments[0][1]}
+            for name, start, end in spans:
+                if start in timings and end in timings:
+                    args = {"text": text} if name == "buffered" else {}
+                    if name == "synthesis":
+                        args = {"speed": timings.get("speed"), "audio samples": timings.get("audio samples")}
+                    events.append({"name": name, "ph": "X", "pid": pid, "tid": sid, "ts": timings[start] * 1000,
+                                   "dur": max(0.0, timings[end] - timings[start]) * 1000, "args": args})
+            if "first audio" in timings:
+                events.append({"name": "first audio", "ph": "i", "s": "t", "pid": pid, "tid": sid, "ts": timings["first audio"] * 1000})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def stats(self):
+        with self.lock:
+            return {"sample rate": self.sample_rate, "traced sentences": self.traced, "kept": len(self.traces)}